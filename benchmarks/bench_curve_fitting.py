@@ -0,0 +1,50 @@
+"""
+Benchmarks of the fitting paths in scireputils.curve_fitting.
+Run as: python benchmarks/bench_curve_fitting.py
+"""
+import timeit
+
+import numpy as np
+from scipy.optimize import curve_fit
+
+from scireputils.curve_fitting import FitCurve, f_cubic, f_gaussian, f_line, f_para
+
+
+def _report(name, seconds, repeat):
+    print(f"{name:<45} {seconds / repeat * 1e3:10.2f} ms")
+
+
+def bench_linear_models(n_points=1_000_000, repeat=3):
+    rng = np.random.default_rng(0)
+    x = np.linspace(-10, 10, n_points)
+    sigma = rng.uniform(0.5, 1.5, n_points)
+
+    print(f"linear models, {n_points} points")
+    for f in (f_line, f_para, f_cubic):
+        y = f(x, *rng.uniform(-2, 2, f.__code__.co_argcount - 1)) + rng.normal(0, 1, n_points)
+
+        t = timeit.timeit(lambda: curve_fit(f, x, y, sigma=sigma), number=repeat)
+        _report(f"{f.__name__} curve_fit", t, repeat)
+        t = timeit.timeit(lambda: FitCurve(f, x, y, sigma=sigma), number=repeat)
+        _report(f"{f.__name__} FitCurve (direct solve)", t, repeat)
+
+
+def bench_gaussian_datasets(n_sets=2000, n_points=200, repeat=3):
+    rng = np.random.default_rng(0)
+    x = np.linspace(-5, 5, n_points)
+    h, mu, sigma = (rng.uniform(lo, hi, (n_sets, 1)) for lo, hi in ((1, 3), (-1, 1), (0.5, 1.5)))
+    ydata = f_gaussian(x, h, mu, sigma, 0.1) + rng.normal(0, 0.05, (n_sets, n_points))
+    p0 = [2, 0, 1, 0]
+
+    print(f"f_gaussian, {n_sets} datasets of {n_points} points")
+    t = timeit.timeit(lambda: [curve_fit(f_gaussian, x, y, p0=p0) for y in ydata], number=repeat)
+    _report("curve_fit loop (numeric jacobian)", t, repeat)
+    t = timeit.timeit(lambda: [FitCurve(f_gaussian, x, y, p0=p0) for y in ydata], number=repeat)
+    _report("FitCurve loop (analytic jacobian)", t, repeat)
+    t = timeit.timeit(lambda: FitCurve.fit_many(f_gaussian, x, ydata, p0=p0), number=repeat)
+    _report("FitCurve.fit_many", t, repeat)
+
+
+if __name__ == "__main__":
+    bench_linear_models()
+    bench_gaussian_datasets()
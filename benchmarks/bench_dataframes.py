@@ -0,0 +1,49 @@
+"""
+Benchmarks of csv loading in scireputils.dataframes.
+Run as: python benchmarks/bench_dataframes.py
+"""
+import os
+import tempfile
+import timeit
+
+import numpy as np
+
+from scireputils.dataframes import dataframe_from_csv
+
+
+def _report(name, seconds, repeat):
+    print(f"{name:<45} {seconds / repeat * 1e3:10.2f} ms")
+
+
+def write_synthetic_csv(path, n_rows, n_cols=6, seed=0):
+    """
+    Writes an instrument-log-like csv with spaces around commas, comments and blank lines.
+    """
+    rng = np.random.default_rng(seed)
+    data = rng.normal(size=(n_rows, n_cols))
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("# synthetic measurement\n")
+        f.write(" , ".join(f"col{i}" for i in range(n_cols)) + "\n")
+        for i, row in enumerate(data):
+            if i % 1000 == 0:
+                f.write(f"# block {i // 1000}\n\n")
+            f.write(" , ".join(f"{v:.6f}" for v in row) + "\n")
+
+
+def bench_dataframe_from_csv(row_counts=(10_000, 100_000, 1_000_000), repeat=3):
+    with tempfile.TemporaryDirectory() as directory:
+        for n_rows in row_counts:
+            path = os.path.join(directory, f"synthetic_{n_rows}.csv")
+            write_synthetic_csv(path, n_rows)
+            size_mb = os.path.getsize(path) / 2 ** 20
+
+            print(f"dataframe_from_csv, {n_rows} rows, {size_mb:.1f} MB")
+            t = timeit.timeit(lambda: dataframe_from_csv(path), number=repeat)
+            _report("python engine", t, repeat)
+            t = timeit.timeit(lambda: dataframe_from_csv(path, fast=True), number=repeat)
+            _report("fast (C engine)", t, repeat)
+
+
+if __name__ == "__main__":
+    bench_dataframe_from_csv()
@@ -0,0 +1,100 @@
+"""
+Benchmarks of table generation and template rendering in scireputils.latex_templates.
+Run as: python benchmarks/bench_latex_templates.py
+"""
+import os
+import tempfile
+import timeit
+
+import jinja2
+import numpy as np
+import pandas as pd
+
+from scireputils._dataframe_to_booktabs_table import _make_formater_from_s_col_format_string
+from scireputils.latex_templates import _LATEX_JINJA_OPTIONS
+from scireputils.latex_templates import dataframe_to_booktabs_table
+from scireputils.latex_templates import render_template
+from scireputils.latex_templates import render_templates
+
+
+def _report(name, seconds, repeat):
+    print(f"{name:<45} {seconds / repeat * 1e3:10.2f} ms")
+
+
+def _legacy_table_rows(df, column_properties):
+    """
+    The original per-column Series.to_string formatting and Python padding, for comparison.
+    """
+    columns = []
+    for col_name, quantity_name, unit, s_col_format in column_properties:
+        float_format = _make_formater_from_s_col_format_string(s_col_format) if s_col_format else None
+        str_data = df[col_name].to_string(index=False, float_format=float_format).split("\n")
+
+        len_of_longest = len(max(str_data + [quantity_name, unit], key=len))
+        right_adjust = f"{{:>{len_of_longest}}}".format
+        columns.append([quantity_name.ljust(len_of_longest), unit.ljust(len_of_longest)]
+                       + [right_adjust(s) for s in str_data])
+
+    return [" & ".join(r) + r" \\" for r in zip(*columns)]
+
+
+def bench_dataframe_to_booktabs_table(n_rows=200_000, repeat=3):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "t": np.arange(n_rows),
+        "u": rng.normal(size=n_rows),
+        "i": rng.normal(size=n_rows) * 1e-3,
+    })
+    column_properties = [("t", "t", "s", None), ("u", "U", "V", "1.4"), ("i", "I", "A", "1.3e1")]
+
+    print(f"booktabs table, {n_rows} rows")
+    t = timeit.timeit(lambda: _legacy_table_rows(df, column_properties), number=repeat)
+    _report("Series.to_string per column", t, repeat)
+    t = timeit.timeit(lambda: dataframe_to_booktabs_table(df, column_properties), number=repeat)
+    _report("dataframe_to_booktabs_table", t, repeat)
+
+
+_FRAGMENT_TEMPLATE = r"""
+\section{\VAR{name}}
+%% for key, value in values.items()
+\VAR{key} & \VAR{"%.3f" % value} \\
+%% endfor
+\BLOCK{if note}\VAR{note}\BLOCK{endif}
+"""
+
+
+def _legacy_render_template(template_path, output_path, **variables):
+    """
+    The original render_template with a new environment for every call, for comparison.
+    """
+    template_dir, template_name = os.path.split(template_path)
+    env = jinja2.Environment(loader=jinja2.FileSystemLoader(os.path.abspath(template_dir)), **_LATEX_JINJA_OPTIONS)
+    rendered = env.get_template(template_name).render(**variables)
+    with open(output_path, "w+", encoding="utf-8") as out:
+        out.write(rendered)
+
+
+def bench_render_template(n_fragments=500):
+    variable_sets = [dict(name=f"sample {i}", values={f"q{j}": i * j / 7 for j in range(10)}, note="")
+                     for i in range(n_fragments)]
+
+    print(f"render template, {n_fragments} fragments")
+    with tempfile.TemporaryDirectory() as tmp:
+        template_path = os.path.join(tmp, "fragment.tex")
+        with open(template_path, "w") as f:
+            f.write(_FRAGMENT_TEMPLATE)
+        outputs = {os.path.join(tmp, f"fragment_{i}.tex"): v for i, v in enumerate(variable_sets)}
+
+        t = timeit.timeit(lambda: [_legacy_render_template(template_path, p, **v) for p, v in outputs.items()], number=1)
+        _report("new environment per call", t, 1)
+        t = timeit.timeit(lambda: [render_template(template_path, p, **v) for p, v in outputs.items()], number=1)
+        _report("render_template, cached environment", t, 1)
+        t = timeit.timeit(lambda: render_templates(template_path, outputs), number=1)
+        _report("render_templates", t, 1)
+        t = timeit.timeit(lambda: render_templates(template_path, outputs), number=1)
+        _report("render_templates, unchanged output", t, 1)
+
+
+if __name__ == "__main__":
+    bench_dataframe_to_booktabs_table()
+    bench_render_template()
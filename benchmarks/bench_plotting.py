@@ -0,0 +1,59 @@
+"""
+Benchmarks of plot downsampling in scireputils.plotting.
+Run as: python benchmarks/bench_plotting.py
+"""
+import io
+import timeit
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from scireputils.plotting import downsample
+from scireputils.plotting import plot_downsampled
+
+
+def _report(name, seconds, repeat):
+    print(f"{name:<45} {seconds / repeat * 1e3:10.2f} ms")
+
+
+def _save_pdf(plot):
+    fig, ax = plt.subplots()
+    plot(ax)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="pdf")
+    plt.close(fig)
+    return buffer.tell()
+
+
+def bench_downsample(n_points=10 ** 7, repeat=3):
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 10, n_points)
+    y = np.sin(x) + rng.normal(scale=0.1, size=n_points)
+
+    print(f"downsample, {n_points} points to 1000 pixel columns")
+    for method in ("minmax", "lttb"):
+        t = timeit.timeit(lambda: downsample(x, y, 1000, method), number=repeat)
+        _report(method, t, repeat)
+
+
+def bench_pdf(n_points=10 ** 6):
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 10, n_points)
+    y = np.sin(x) + rng.normal(scale=0.1, size=n_points)
+
+    print(f"pdf of a trace, {n_points} points")
+    sizes = {}
+    t = timeit.timeit(lambda: sizes.update(full=_save_pdf(lambda ax: ax.plot(x, y))), number=1)
+    _report("ax.plot", t, 1)
+    t = timeit.timeit(lambda: sizes.update(downsampled=_save_pdf(lambda ax: plot_downsampled(x, y, ax=ax))), number=1)
+    _report("plot_downsampled", t, 1)
+    print(f"pdf size {sizes['full'] / 1e3:.0f} kB -> {sizes['downsampled'] / 1e3:.0f} kB")
+
+
+if __name__ == "__main__":
+    bench_downsample()
+    bench_pdf()
@@ -0,0 +1,47 @@
+"""
+Benchmarks of Spline helpers in scireputils.curve_fitting.
+Run as: python benchmarks/bench_spline.py
+"""
+import timeit
+
+import numpy as np
+
+from scireputils.curve_fitting import monotonize
+
+
+def _report(name, seconds, repeat):
+    print(f"{name:<45} {seconds / repeat * 1e3:10.2f} ms")
+
+
+def _monotonize_loop(xdata, ydata):
+    """
+    The original pure Python implementation, for comparison.
+    """
+    highest = xdata[0] - 1
+    new_x = []
+    new_y = []
+
+    for x, y in zip(xdata, ydata):
+        if x > highest:
+            new_x.append(x)
+            new_y.append(y)
+            highest = x
+
+    return np.array(new_x), np.array(new_y)
+
+
+def bench_monotonize(n_points=10_000_000, repeat=3):
+    rng = np.random.default_rng(0)
+    x = np.cumsum(rng.normal(1, 2, n_points))
+    y = rng.normal(size=n_points)
+
+    print(f"monotonize, {n_points} points")
+    t = timeit.timeit(lambda: _monotonize_loop(x, y), number=1)
+    _report("python loop", t, 1)
+    for strategy in ("drop", "sort", "average"):
+        t = timeit.timeit(lambda: monotonize(x, y, strategy), number=repeat)
+        _report(f"monotonize {strategy}", t, repeat)
+
+
+if __name__ == "__main__":
+    bench_monotonize()
@@ -0,0 +1,129 @@
+import contextlib
+import functools
+import hashlib
+import inspect
+import os
+import threading
+import types
+
+import numpy as np
+
+
+class _UncacheableError(TypeError):
+    """
+    Raised by _hash_value for values that can not be hashed reliably, e.g. functions without source.
+    """
+
+
+def _hash_value(h, value, seen=None):
+    """
+    Updates hash h with value for cache keys. Containers are hashed recursively,
+    arrays by content and functions by their source together with everything their
+    result depends on: defaults, closure cells, constants and referenced global data.
+    Raises _UncacheableError for python functions without source.
+    """
+    if isinstance(value, dict):
+        h.update(b"dict")
+        for k in sorted(value, key=str):
+            _hash_value(h, k, seen)
+            _hash_value(h, value[k], seen)
+    elif isinstance(value, (list, tuple)) and not all(np.isscalar(v) for v in value):
+        h.update(type(value).__name__.encode())
+        for v in value:
+            _hash_value(h, v, seen)
+    elif isinstance(value, functools.partial):
+        h.update(b"partial")
+        for v in (value.func, value.args, value.keywords):
+            _hash_value(h, v, seen)
+    elif isinstance(value, type) or callable(value):
+        h.update(f"{getattr(value, '__module__', '')}:{getattr(value, '__qualname__', repr(value))}".encode())
+        if hasattr(value, "__code__"):
+            _hash_function(h, value, set() if seen is None else seen)
+        else:
+            try:
+                h.update(inspect.getsource(value).encode())
+            except (OSError, TypeError):
+                h.update(repr(value).encode())
+    elif value is None or isinstance(value, (str, bool, int, float)):
+        h.update(repr(value).encode())
+    else:
+        array = np.ascontiguousarray(value)
+        h.update(f"{array.dtype.str}{array.shape}".encode())
+        if array.dtype.hasobject:
+            h.update(repr(array.tolist()).encode())
+        else:
+            h.update(array.data)
+
+
+def _hash_function(h, f, seen):
+    if id(f) in seen:
+        h.update(b"recursion")
+        return
+    seen.add(id(f))
+
+    try:
+        h.update(inspect.getsource(f).encode())
+    except (OSError, TypeError) as e:
+        raise _UncacheableError(f"Source of {f!r} is not available, it can not be cached") from e
+
+    _hash_value(h, f.__defaults__, seen)
+    _hash_value(h, f.__kwdefaults__, seen)
+    for cell in f.__closure__ or ():
+        try:
+            _hash_value(h, cell.cell_contents, seen)
+        except ValueError:
+            h.update(b"empty cell")
+
+    names = set()
+    _hash_code(h, f.__code__, names)
+    f_globals = getattr(f, "__globals__", {})
+    for name in sorted(names):
+        if name not in f_globals:
+            continue
+        value = f_globals[name]
+        if isinstance(value, types.ModuleType):
+            continue
+        if (isinstance(value, type) or callable(value)) and getattr(value, "__module__", None) != f.__module__:
+            continue
+        h.update(name.encode())
+        _hash_value(h, value, seen)
+
+
+def _hash_code(h, code, names):
+    """
+    Hashes constants of code and of the nested functions, collects the global names they use.
+    """
+    names.update(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _hash_code(h, const, names)
+        else:
+            h.update(repr(const).encode())
+
+
+def _file_sha256(path):
+    """
+    Hex sha256 of the content of a file, read in blocks.
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(2 ** 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+@contextlib.contextmanager
+def _atomic_open(path, mode="w", **kwargs):
+    """
+    Opens a temporary file next to path, which replaces path when the block finishes
+    without an exception, so that readers never see a partially written file.
+    The temporary name is unique per process and thread.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, mode, **kwargs) as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
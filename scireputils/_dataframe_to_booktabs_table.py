@@ -1,3 +1,9 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+
 def _parse_column_property(cp):
     if isinstance(cp, str):
         cp = cp.split()
@@ -22,21 +28,162 @@ def _parse_column_property(cp):
 def _make_column_strings_equal_length(quantity_name, unit, str_data):
     """
     finds lenght of the longest string in column and fills others to that length,
-    quantity and unit aligned left and data right
+    quantity and unit aligned left and data right, returns numpy array of strings
+    """
+    str_data = np.asarray(str_data, dtype=str)
+    longest_data = int(np.char.str_len(str_data).max()) if str_data.size else 0
+    len_of_longest = max(longest_data, len(quantity_name), len(unit))
+
+    right_adjusted = np.char.rjust(str_data, len_of_longest)
+    head = np.array([quantity_name.ljust(len_of_longest), unit.ljust(len_of_longest)])
+
+    return np.concatenate([head, right_adjusted])
+
+
+def _format_column_values(series, float_format=None):
+    """
+    Formats values the same way as series.to_string(index=False, float_format=float_format).split("\n")
+    up to justification. Integer columns and float columns with float_format are formatted
+    in bulk, other columns fall back to pandas.
+    """
+    if len(series) and isinstance(series.dtype, np.dtype):
+        formatted = _format_array_values(series.to_numpy(), float_format)
+        if formatted is not None:
+            return formatted
+
+    return series.to_string(index=False, float_format=float_format).split("\n")
+
+
+def _format_array_values(values, float_format=None):
+    """
+    Bulk formatting of integer arrays and float arrays with float_format, same as
+    _format_column_values. Returns None for arrays that have to be formatted by pandas.
+    """
+    if values.dtype.kind in "iu":
+        return values.astype(str)
+
+    if values.dtype.kind == "f" and float_format is not None:
+        formatted = np.array(list(map(float_format, values.tolist())), dtype=str)
+        return np.where(np.isnan(values), "NaN", formatted)
+
+    return None
+
+
+def _round_half_up(x):
+    """
+    Rounds to integers with ties up, x is first rounded to 9 decimals so that
+    ties like 0.35 * 10 = 3.4999999999999996 are recognized.
+    """
+    return np.floor(np.round(x, 9) + 0.5)
+
+
+def _format_values_with_errors(values, errors, error_digits=1, float_format=None):
+    """
+    Formats value \\pm error cells for siunitx S columns in bulk. Errors are rounded
+    to error_digits significant digits and values to the same decimal place. Errors are
+    rounded half up (0.25 -> 0.3), so that they are never understated, values to the nearest
+    with ties to even. Values without a finite positive error are formatted without
+    uncertainty. Returns the cells and a table-format string fitting all of them, None if no
+    value has an error.
+    """
+    values = np.asarray(values, dtype=float)
+    errors = np.broadcast_to(np.asarray(errors, dtype=float), values.shape)
+    valid = np.isfinite(errors) & (errors > 0) & np.isfinite(values)
+
+    cells = np.empty(values.shape, dtype=object)
+    if float_format is not None:
+        cells[~valid] = _format_array_values(values[~valid], float_format)
+    else:
+        cells[~valid] = np.char.mod("%g", values[~valid])
+    cells[np.isnan(values)] = "NaN"
+
+    value, error = values[valid], errors[valid]
+    if not value.size:
+        return cells.astype(str), None
+
+    exponent = np.floor(np.log10(error))
+    decimals = (error_digits - 1 - exponent).astype(int)
+    # rounding may carry into the next digit, e.g. 0.096 -> 0.10
+    scale = 10.0 ** decimals
+    rounded = _round_half_up(error * scale) / scale
+    decimals -= np.floor(np.log10(rounded)) > exponent
+
+    value_strings = np.empty(value.shape, dtype=object)
+    error_strings = np.empty(value.shape, dtype=object)
+    for d in np.unique(decimals):
+        group = decimals == d
+        step = 10.0 ** -d
+        fmt = f"%.{max(d, 0)}f"
+        value_strings[group] = np.char.mod(fmt, np.rint(value[group] / step) * step)
+        error_strings[group] = np.char.mod(fmt, _round_half_up(error[group] / step) * step)
+    cells[valid] = np.char.add(np.char.add(value_strings.astype(str), r" \pm "), error_strings.astype(str))
+
+    finite = np.isfinite(values)
+    plain_strings = [
+        s.lstrip("-") for s in np.concatenate([value_strings.astype(str), cells[~valid & finite].astype(str)])
+        if "e" not in s.lower()
+    ]
+    sign = "-" if (values[finite] < 0).any() else ""
+    integer_digits = max(len(s.partition(".")[0]) for s in plain_strings)
+    fraction_digits = max(int(decimals.clip(min=0).max()), max(len(s.partition(".")[2]) for s in plain_strings))
+    uncertainty_digits = len(str(int(_round_half_up(error * 10.0 ** decimals.clip(min=0)).max())))
+    table_format = f"{sign}{integer_digits}.{fraction_digits}({uncertainty_digits})"
+
+    return cells.astype(str), table_format
+
+
+def _add_uncertainty_format(format_string, derived_format):
+    """
+    Adds the uncertainty part of derived_format, e.g. (1), to a given table-format such as 1.2
+    or 4.3e1, so that siunitx aligns the \\pm cells. Formats with an uncertainty are kept.
     """
+    if derived_format is None or "(" in format_string:
+        return format_string
+
+    mantissa, e, exponent = format_string.partition("e")
+    return f"{mantissa}{derived_format[derived_format.index('('):]}{e}{exponent}"
 
-    len_of_longest = len(max(str_data + [quantity_name, unit], key=len))
 
-    right_adjust = f"{{:>{len_of_longest}}}".format
-    right_adjusted = [right_adjust(s) for s in str_data]
-    left_adjust = f"{{:<{len_of_longest}}}".format
-    quantity_name = left_adjust(quantity_name)
-    unit = left_adjust(unit)
+def _formatted_width(series, float_format=None):
+    """
+    Length of the longest string of _format_column_values. For integer columns and
+    float columns with float_format only the extreme values are formatted.
+    """
+    if not len(series):
+        return 0
+
+    dtype = series.dtype
+    values = series.to_numpy()
+    if isinstance(dtype, np.dtype) and (dtype.kind in "iu" or dtype.kind == "f" and float_format is not None):
+        finite = values[np.isfinite(values)] if dtype.kind == "f" else values
+        candidates = [] if finite.size == len(values) else list(_format_column_values(series[~np.isfinite(values)]))
+        if finite.size:
+            # the smallest magnitudes matter for the exponent length of e formats
+            positive = finite[finite > 0]
+            negative = finite[finite < 0]
+            extremes = [finite.min(), finite.max()]
+            extremes += [positive.min()] if positive.size else []
+            extremes += [negative.max()] if negative.size else []
+            candidates += list(_format_column_values(pd.Series(np.array(extremes, dtype=dtype)), float_format))
+        return max(len(c) for c in candidates)
+
+    return max(len(s) for s in _format_column_values(series, float_format))
+
+
+def _join_columns(columns, separator=" & ", row_end=r" \\"):
+    """
+    Joins equally long arrays of cell strings into table rows, vectorized.
+    """
+    rows = columns[0]
+    for column in columns[1:]:
+        rows = np.char.add(np.char.add(rows, separator), column)
 
-    return [quantity_name, unit] + right_adjusted
+    return np.char.add(rows, row_end).tolist()
 
 
 def _make_formater_from_s_col_format_string(format_string):
+    # the uncertainty part, e.g. (1) of 1.2(1), does not affect the values
+    format_string = re.sub(r"\(\d*\)", "", format_string)
     fmt = format_string
 
     if "e" in format_string:
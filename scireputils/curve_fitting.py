@@ -1,9 +1,22 @@
+import hashlib
+import importlib
+import inspect
+import os
+import pickle
 import warnings
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
 import numpy as np
 from scipy.interpolate import UnivariateSpline
+from scipy.linalg import qr, solve_triangular
 from scipy.optimize import curve_fit
 
+from scireputils._cache_utils import _atomic_open
+from scireputils._cache_utils import _UncacheableError
+from scireputils._cache_utils import _hash_value
+
 
 def f_line(x, a, b):
     """
@@ -54,46 +67,374 @@ def f_sin(x, amp, omega, phi, dy):
     return amp * np.sin(omega * x + phi) + dy
 
 
-class FitCurve:
+def _polynomial_design(degree):
     """
-    Class representing function fitted to some data. Objects are callable.
-    Arguments are the same as for scipy.optimize.curve_fit.
+    Design matrix builder of a polynomial with coefficients from the highest power,
+    same parameter order as f_line, f_para and f_cubic.
+    """
+
+    def design(x):
+        powers = np.cumprod(np.broadcast_to(x[..., np.newaxis], x.shape + (degree,)), axis=-1)
+        return np.concatenate([powers[..., ::-1], np.ones(x.shape + (1,))], axis=-1)
+
+    return design
+
+
+def _stack_jacobian(*derivatives):
+    """
+    Stacks partial derivatives into a jacobian with parameters in the last axis.
+    """
+    return np.stack(np.broadcast_arrays(*derivatives), axis=-1)
+
+
+def _jac_line(x, a, b):
+    return _stack_jacobian(x, 1.0)
+
+
+def _jac_para(x, a, b, c):
+    return _stack_jacobian(x ** 2, x, 1.0)
+
+
+def _jac_cubic(x, a, b, c, d):
+    x2 = x ** 2
+    return _stack_jacobian(x2 * x, x2, x, 1.0)
+
+
+def _jac_exp(x, a, b, c, d):
+    e = np.exp(b * (x + c))
+    return _stack_jacobian(e, a * (x + c) * e, a * b * e, 1.0)
+
+
+def _jac_exp_simple(x, a, b):
+    e = np.exp(b * x)
+    return _stack_jacobian(e, a * x * e)
+
+
+def _jac_gaussian(x, h, mu, sigma, dy):
+    dx = x - mu
+    g = np.exp(-dx ** 2 / (2 * sigma ** 2))
+    return _stack_jacobian(g, h * g * dx / sigma ** 2, h * g * dx ** 2 / sigma ** 3, 1.0)
+
+
+def _jac_sin(x, amp, omega, phi, dy):
+    arg = omega * x + phi
+    amp_cos = amp * np.cos(arg)
+    return _stack_jacobian(np.sin(arg), amp_cos * x, amp_cos, 1.0)
+
+
+# Analytic jacobians of the built-in models, same signature as the models
+_JACOBIANS = {
+    f_line: _jac_line,
+    f_para: _jac_para,
+    f_cubic: _jac_cubic,
+    f_exp: _jac_exp,
+    f_exp_simple: _jac_exp_simple,
+    f_gaussian: _jac_gaussian,
+    f_sin: _jac_sin,
+}
+
+# Models linear in parameters with their design matrix builders
+_LINEAR_MODELS = {
+    f_line: _polynomial_design(1),
+    f_para: _polynomial_design(2),
+    f_cubic: _polynomial_design(3),
+}
+
+
+def _cumulative_integral(x, y):
+    """
+    Cumulative trapezoidal integral of y over x along the last axis, starting at 0.
+    """
+    areas = 0.5 * (y[..., 1:] + y[..., :-1]) * np.diff(x, axis=-1)
+    return np.concatenate([np.zeros(areas.shape[:-1] + (1,)), np.cumsum(areas, axis=-1)], axis=-1)
+
+
+def _regression(columns, y):
+    """
+    Ordinary least squares coefficients of y on the columns along the last axis.
+    """
+    design = np.stack(columns, axis=-1)
+    design_t = np.swapaxes(design, -1, -2)
+    return np.linalg.solve(design_t @ design, (design_t @ y[..., np.newaxis]))[..., 0]
+
+
+def _p0_polynomial(x, y, degree):
+    design = _polynomial_design(degree)(x)
+    return _regression([design[..., j] for j in range(degree + 1)], y)
+
+
+def _p0_exp(x, y):
+    # y' = b (y - d) integrated: y = y0 + b S - b d (x - x0), a linear regression in 1, S, x
+    dx = x - x[..., :1]
+    coefs = _regression([np.ones_like(y), _cumulative_integral(x, y), dx], y)
+    b = coefs[..., 1]
+    d = -coefs[..., 2] / b
+    c = -x.mean(axis=-1)
+    e = np.exp(b[..., np.newaxis] * (x + c[..., np.newaxis]))
+    a = np.sum(e * (y - d[..., np.newaxis]), axis=-1) / np.sum(e ** 2, axis=-1)
+    return np.stack([a, b, c, d], axis=-1)
+
+
+def _p0_exp_simple(x, y):
+    sign = np.where(np.mean(y, axis=-1) < 0, -1.0, 1.0)
+    log_y = np.log(np.maximum(np.abs(y), np.finfo(float).tiny))
+    intercept, b = np.moveaxis(_regression([np.ones_like(y), x], log_y), -1, 0)
+    return np.stack([sign * np.exp(intercept), b], axis=-1)
+
+
+def _p0_gaussian(x, y):
+    y_max, y_min, y_median = y.max(axis=-1), y.min(axis=-1), np.median(y, axis=-1)
+    peak = y_max - y_median >= y_median - y_min
+    dy = np.where(peak, y_min, y_max)
+    h = np.where(peak, y_max - y_min, y_min - y_max)
+    mu = np.take_along_axis(x, np.where(peak, y.argmax(axis=-1), y.argmin(axis=-1))[..., np.newaxis], -1)[..., 0]
+    area = np.abs(_cumulative_integral(x, y - dy[..., np.newaxis])[..., -1])
+    sigma = area / (np.abs(h) * np.sqrt(2 * np.pi))
+    return np.stack([h, mu, sigma, dy], axis=-1)
+
+
+def _p0_sin(x, y):
+    n_points = y.shape[-1]
+    dy = y.mean(axis=-1)
+    amp = np.sqrt(2) * y.std(axis=-1)
+    step = (x[..., -1] - x[..., 0]) / (n_points - 1)
+
+    spectrum = np.fft.rfft(y - dy[..., np.newaxis], axis=-1)
+    power = np.abs(spectrum)
+    power[..., 0] = 0
+    k = power.argmax(axis=-1)[..., np.newaxis]
+
+    # parabolic interpolation of the spectral peak
+    left = np.take_along_axis(power, np.maximum(k - 1, 0), -1)
+    center = np.take_along_axis(power, k, -1)
+    right = np.take_along_axis(power, np.minimum(k + 1, power.shape[-1] - 1), -1)
+    denominator = left - 2 * center + right
+    shift = np.where(denominator != 0, 0.5 * (left - right) / np.where(denominator != 0, denominator, 1), 0)
+
+    omega = 2 * np.pi * (k + shift)[..., 0] / (n_points * step)
+    phi = np.angle(np.take_along_axis(spectrum, k, -1)[..., 0]) + np.pi / 2 - omega * x[..., 0]
+    return np.stack([amp, omega, np.mod(phi, 2 * np.pi), dy], axis=-1)
+
+
+# Initial parameter estimators of the built-in models, called as estimator(x, y)
+# with data in the last axis, so that rows of many datasets are estimated at once
+_P0_ESTIMATORS = {
+    f_line: lambda x, y: _p0_polynomial(x, y, 1),
+    f_para: lambda x, y: _p0_polynomial(x, y, 2),
+    f_cubic: lambda x, y: _p0_polynomial(x, y, 3),
+    f_exp: _p0_exp,
+    f_exp_simple: _p0_exp_simple,
+    f_gaussian: _p0_gaussian,
+    f_sin: _p0_sin,
+}
+
+
+def _estimate_p0(f, xdata, ydata):
+    """
+    Initial parameters of a built-in model estimated from the data, (K, N) array
+    for (K, M) ydata. Returns None for other models, non-finite estimates are replaced
+    by ones like the default of curve_fit.
+    """
+    if f not in _P0_ESTIMATORS:
+        return None
+
+    x, y = np.broadcast_arrays(np.asarray(xdata, dtype=float), np.asarray(ydata, dtype=float))
+    with np.errstate(all="ignore"):
+        try:
+            p0 = _P0_ESTIMATORS[f](x, y)
+        except np.linalg.LinAlgError:
+            p0 = np.ones(y.shape[:-1] + (_n_params(f),))
+
+    return np.where(np.isfinite(p0), p0, 1.0)
+
+
+def _clip_to_bounds(p0, bounds):
+    """
+    Moves estimated parameters strictly inside curve_fit bounds, (lb, ub) pair or scipy.optimize.Bounds.
+    """
+    lb, ub = (bounds.lb, bounds.ub) if hasattr(bounds, "lb") else bounds
+    lb = np.broadcast_to(np.asarray(lb, dtype=float), p0.shape)
+    ub = np.broadcast_to(np.asarray(ub, dtype=float), p0.shape)
+
+    with np.errstate(invalid="ignore"):
+        low = np.where(np.isfinite(lb), lb + 1e-10 * np.maximum(1, np.abs(lb)), lb)
+        high = np.where(np.isfinite(ub), ub - 1e-10 * np.maximum(1, np.abs(ub)), ub)
+        middle = 0.5 * (lb + ub)
+    too_narrow = low > high
+    low = np.where(too_narrow, middle, low)
+    high = np.where(too_narrow, middle, high)
+
+    return np.clip(p0, low, high)
+
+
+def _fit(f, xdata, ydata, p0=None, sigma=None, *args, linear=None, **kwargs):
+    """
+    Fits f to the data the same way FitCurve does, returns parameters and covariance.
+    Raises ValueError if the covariance could not be estimated.
+    """
+    if linear is None:
+        linear = f in _LINEAR_MODELS
+
+    if linear and not args and set(kwargs) <= {"absolute_sigma"}:
+        params, cov = _linear_least_squares(
+            f,
+            np.asarray_chkfinite(xdata, dtype=float),
+            np.atleast_2d(np.asarray_chkfinite(ydata, dtype=float)),
+            # a covariance matrix of ydata is shared by the single dataset
+            np.asarray(sigma)[np.newaxis] if np.ndim(sigma) == 2 else sigma,
+            kwargs.get("absolute_sigma", False)
+        )
+        params, cov = params[0], cov[0]
+    else:
+        if f in _JACOBIANS and "jac" not in kwargs and len(args) < 5:
+            kwargs["jac"] = _JACOBIANS[f]
+        if p0 is None:
+            p0 = _estimate_p0(f, xdata, ydata)
+            # bounds are the 3rd optional positional argument of curve_fit after sigma
+            bounds = kwargs.get("bounds", args[2] if len(args) > 2 else None)
+            if p0 is not None and bounds is not None:
+                p0 = _clip_to_bounds(p0, bounds)
+        params, cov = curve_fit(f, xdata, ydata, p0, sigma, *args, **kwargs)
+
+    if len(np.where(cov == np.inf)[0]) > 0:
+        raise ValueError(
+            "Fit unsuccessful, provide better initial parameters (p0)")
+
+    return params, cov
+
+
+class FitCache:
+    """
+    Opt-in on-disk cache of fits, used by FitCurve and Spline through their cache argument.
+    Entries are keyed by a hash of the function source, data and all fit options.
+    When the cache grows over max_size, least recently used entries are removed.
 
     Parameters
     ----------
-    f: callable
-        Function to fit parameters to.
-        Has to have format f(x, param1, param2, ...)
-    xdata: M-length sequence
-        X values of data points.
-    ydata: M-length sequence
-        Y values of data points.
-    p0: None, scalar or N-length sequence
-        Initial guess for the parameters.
-    sigma: None or M-length sequence
-        Determines the uncertainty of ydata.
+    directory: str
+        Directory to keep the cache files in, created if it does not exist.
+    max_size: int
+        Maximal total size of the cache files in bytes.
     """
 
-    def __init__(self, f, xdata, ydata, *args, **kwargs):
-        params, cov = curve_fit(f, xdata, ydata, *args, **kwargs)
-        errors = [np.sqrt(cov[i, i]) for i in range(len(cov))]
+    VERSION = 1
 
-        if len(np.where(cov == np.inf)[0]) > 0:
-            raise ValueError(
-                "Fit unsuccessful, provide better initial parameters (p0)")
+    def __init__(self, directory, max_size=100 * 2 ** 20):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_size = max_size
 
-        self.params = params
-        self.errors = errors
-        self.xdata = np.array(xdata)
-        self.ydata = np.array(ydata)
-        self.f = lambda x: f(x, *params)
+    def key(self, *values):
+        """
+        Hash of the values, arrays are hashed by content and functions by source,
+        defaults, closures and global data they use. Functions without source can
+        not be hashed reliably, _UncacheableError is raised for them.
+        """
+        h = hashlib.sha256(f"{self.VERSION}".encode())
+        for value in values:
+            _hash_value(h, value)
+        return h.hexdigest()
+
+    def load(self, key):
+        """
+        Returns the cached value or None if there is none.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+        os.utime(path)
+        return value
+
+    def store(self, key, value):
+        """
+        Saves the value and evicts least recently used entries if needed.
+        """
+        path = self._path(key)
+        with _atomic_open(path, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        self._evict()
+
+    def clear(self):
+        """
+        Removes all entries.
+        """
+        for entry in self._entries():
+            os.remove(entry.path)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".pkl")
+
+    def _entries(self):
+        return [e for e in os.scandir(self.directory) if e.name.endswith(".pkl")]
+
+    def _evict(self):
+        entries = sorted(
+            ((e.stat().st_mtime, e.stat().st_size, e.path) for e in self._entries()),
+            reverse=True
+        )
+
+        total = 0
+        for _, size, path in entries:
+            total += size
+            if total > self.max_size:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+class FitResult:
+    """
+    Compact result of a fit, keeps only the model function, parameters, covariance
+    and optionally the fitted data, which are not copied. Objects are callable
+    and picklable if the model is a module level function.
+
+    Parameters
+    ----------
+    model: callable
+        Fitted function of format f(x, param1, param2, ...)
+    params: N-length sequence
+        Fitted parameters.
+    cov: (N, N) array
+        Covariance matrix of the parameters.
+    xdata: None or M-length sequence
+        X values of the fitted data points.
+    ydata: None or M-length sequence
+        Y values of the fitted data points.
+    """
+
+    __slots__ = ("model", "params", "cov", "xdata", "ydata", "_last_curve")
+
+    def __init__(self, model, params, cov, xdata=None, ydata=None):
+        self.model = model
+        self.params = np.asarray(params, dtype=float)
+        self.cov = np.asarray(cov, dtype=float)
+        self.xdata = None if xdata is None else np.asarray(xdata)
+        self.ydata = None if ydata is None else np.asarray(ydata)
+
+    @property
+    def errors(self):
+        return np.sqrt(np.diag(self.cov))
+
+    @property
+    def f(self):
+        return self.__call__
 
     def __call__(self, x):
-        return self.f(x)
+        return self.model(x, *self.params)
+
+    def _curve_state(self):
+        return self.model, tuple(np.ravel(self.params))
 
-    def curve(self, start=None, end=None, res=100, overrun=0):
+    def curve(self, start=None, end=None, res=100, overrun=0, tolerance=None, max_res=10000):
         """
         Calculates the curve of the fit, used as line of theoretical function.
+        The last calculated curve is remembered and returned again for the same arguments.
 
         Parameters
         ----------
@@ -106,33 +447,622 @@ class FitCurve:
         overrun: float, (float, float)
             fraction of x interval to add before start and after end.
             If tuple, the values are used for start and end separately.
+        tolerance: float, optional
+            If given, points are placed adaptively instead of res evenly spaced ones,
+            so that linear interpolation between them deviates from the curve
+            by less than tolerance times the y range of the curve.
+        max_res: int
+            Maximal number of points of the adaptive sampling.
         """
-        if start is None:
-            start = self.xdata.min()
-        if end is None:
-            end = self.xdata.max()
+        if (start is None or end is None) and self.xdata is None:
+            raise ValueError("start and end are needed, the fit does not keep its data")
 
-        interval_length = end - start
+        return _curve(self, start, end, res, overrun, tolerance, max_res)
 
-        try:
-            start -= overrun[0] * interval_length
-            end += overrun[1] * interval_length
-        except TypeError:
-            start -= overrun * interval_length
-            end += overrun * interval_length
+    def to_dict(self):
+        """
+        Converts the result to a dict of builtin types, e.g. for saving as json.
+        The model is referenced by its module and name.
+        """
+        result = {
+            "model": f"{self.model.__module__}:{self.model.__qualname__}",
+            "params": self.params.tolist(),
+            "cov": self.cov.tolist(),
+        }
+        if self.xdata is not None:
+            result["xdata"] = self.xdata.tolist()
+        if self.ydata is not None:
+            result["ydata"] = self.ydata.tolist()
+
+        return result
+
+    @classmethod
+    def from_dict(cls, d):
+        """
+        Inverse of to_dict, the model module is imported.
+        """
+        module_name, qualname = d["model"].split(":")
+        model = importlib.import_module(module_name)
+        for name in qualname.split("."):
+            model = getattr(model, name)
+
+        fit = cls.__new__(cls)
+        FitResult.__init__(fit, model, d["params"], d["cov"], d.get("xdata"), d.get("ydata"))
+        return fit
+
+
+def _curve(obj, start, end, res, overrun, tolerance, max_res):
+    """
+    Implementation of FitResult.curve and Spline.curve, remembers the last curve in obj
+    and returns copies of it.
+    """
+    if start is None:
+        start = obj.xdata.min()
+    if end is None:
+        end = obj.xdata.max()
 
+    interval_length = end - start
+
+    try:
+        start -= overrun[0] * interval_length
+        end += overrun[1] * interval_length
+    except TypeError:
+        start -= overrun * interval_length
+        end += overrun * interval_length
+
+    # the model state is part of the key, params or spline coefficients may be changed in place
+    key = (start, end, res, tolerance, max_res, obj._curve_state())
+    last_key, last_curve = getattr(obj, "_last_curve", (None, None))
+    if key == last_key:
+        return last_curve[0].copy(), last_curve[1].copy()
+
+    if tolerance is None:
         xes = np.linspace(start, end, res)
-        ys = self(xes)
+        ys = obj(xes)
+    else:
+        xes, ys = _adaptive_sample(obj, start, end, tolerance, max_res)
+
+    obj._last_curve = key, (xes.copy(), ys.copy())
+
+    return xes, ys
+
+
+def _adaptive_sample(func, start, end, tolerance, max_res, initial_res=33):
+    """
+    Samples func on [start, end], intervals are bisected while the midpoint value differs
+    from the linear interpolation by more than tolerance times the y range.
+    """
+    xes = np.linspace(start, end, min(initial_res, max_res))
+    ys = np.asarray(func(xes), dtype=float)
 
-        return xes, ys
+    while len(xes) < max_res:
+        mids = 0.5 * (xes[1:] + xes[:-1])
+        mid_ys = np.asarray(func(mids), dtype=float)
+
+        y_range = max(np.ptp(ys), np.ptp(mid_ys)) or 1.0
+        error = np.abs(mid_ys - 0.5 * (ys[1:] + ys[:-1]))
+        refine = np.flatnonzero(error > tolerance * y_range)
+
+        if refine.size == 0:
+            break
+        if len(xes) + refine.size > max_res:
+            refine = refine[np.argsort(error[refine])[::-1][:max_res - len(xes)]]
+            refine.sort()
+
+        xes = np.insert(xes, refine + 1, mids[refine])
+        ys = np.insert(ys, refine + 1, mid_ys[refine])
+
+    return xes, ys
+
+
+class FitCurve(FitResult):
+    """
+    Class representing function fitted to some data. Objects are callable.
+    Arguments are the same as for scipy.optimize.curve_fit.
+
+    Parameters
+    ----------
+    f: callable
+        Function to fit parameters to.
+        Has to have format f(x, param1, param2, ...)
+    xdata: M-length sequence
+        X values of data points.
+    ydata: M-length sequence
+        Y values of data points.
+    p0: None, scalar or N-length sequence
+        Initial guess for the parameters. If None, it is estimated from the data
+        for the built-in models.
+    sigma: None, M-length sequence or MxM array
+        Determines the uncertainty of ydata, standard deviations or covariance matrix
+        as in curve_fit.
+    linear: None or bool
+        Whether f is linear in its parameters, then the fit is solved directly
+        by weighted least squares and p0 is not needed. If None, the polynomial
+        models are recognized automatically. Options of curve_fit other than
+        absolute_sigma fall back to curve_fit.
+    cache: FitCache, optional
+        If given, the fit is loaded from the cache when the function, data
+        and options did not change.
+
+    Built-in models are fitted with their analytic jacobians unless jac is given.
+    The result is stored as in FitResult, the data are not copied.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, f, xdata, ydata, p0=None, sigma=None, *args, linear=None, cache=None, **kwargs):
+        if cache is not None:
+            try:
+                key = cache.key(f, xdata, ydata, p0, sigma, args, linear, kwargs)
+            except _UncacheableError as e:
+                warnings.warn(f"FitCurve: {e}, fitting without the cache")
+                cache = None
+
+        if cache is None:
+            params, cov = _fit(f, xdata, ydata, p0, sigma, *args, linear=linear, **kwargs)
+        else:
+            cached = cache.load(key)
+            if cached is None:
+                params, cov = _fit(f, xdata, ydata, p0, sigma, *args, linear=linear, **kwargs)
+                cache.store(key, (params, cov))
+            else:
+                params, cov = cached
+
+        super().__init__(f, params, cov, xdata, ydata)
+
+    @classmethod
+    def _from_fit(cls, f, params, cov, xdata, ydata):
+        """
+        Creates the object from already fitted parameters without fitting again.
+        """
+        fit = cls.__new__(cls)
+        FitResult.__init__(fit, f, params, cov, xdata, ydata)
+        return fit
+
+    @classmethod
+    def fit_many(cls, f, xdata, ydata, p0=None, sigma=None, **kwargs):
+        """
+        Fits the same function to many datasets at once, see BatchFit.
+
+        Parameters
+        ----------
+        f: callable
+            Function to fit parameters to, has to broadcast like numpy ufuncs.
+        xdata: M-length sequence or (K, M) array
+            X values shared by all datasets or one row per dataset.
+        ydata: (K, M) array
+            Y values, one row per dataset.
+        p0: None, N-length sequence or (K, N) array
+            Initial guess shared by all datasets or one row per dataset.
+        sigma: None, M-length sequence, (K, M) array or (K, M, M) array
+            Determines the uncertainty of ydata.
+
+        Returns
+        -------
+        BatchFit
+        """
+        return BatchFit(f, xdata, ydata, p0=p0, sigma=sigma, **kwargs)
+
+
+def _n_params(f):
+    """
+    Number of fitted parameters of f(x, param1, param2, ...).
+    """
+    return len(inspect.signature(f).parameters) - 1
+
+
+def _eval_batch(f, xdata, params):
+    """
+    Evaluates f for every row of params at once, returns (K, M) array.
+    """
+    columns = [p[:, np.newaxis] for p in params.T]
+    values = f(xdata, *columns)
+
+    return np.broadcast_to(values, (len(params), np.shape(xdata)[-1]))
+
+
+def _jacobian_batch(f, xdata, params, values):
+    """
+    Jacobian of f for every row of params, returns (K, M, N) array.
+    Analytic for the built-in models, forward difference otherwise.
+    """
+    if f in _JACOBIANS:
+        columns = [p[:, np.newaxis] for p in params.T]
+        jac = _JACOBIANS[f](xdata, *columns)
+        shape = values.shape + (params.shape[1],)
+        return jac if jac.shape == shape else np.array(np.broadcast_to(jac, shape))
+
+    steps = np.sqrt(np.finfo(float).eps) * np.maximum(np.abs(params), 1)
+    jac = np.empty(values.shape + (params.shape[1],))
+
+    for j in range(params.shape[1]):
+        shifted = params.copy()
+        shifted[:, j] += steps[:, j]
+        jac[:, :, j] = (_eval_batch(f, xdata, shifted) - values) / steps[:, j, np.newaxis]
+
+    return jac
+
+
+class BatchFit:
+    """
+    One function fitted to many datasets at once with a vectorized Levenberg-Marquardt
+    iteration, residuals and jacobians of all datasets are evaluated together.
+    Unlike FitCurve, a failed fit does not raise, it is marked in the success array
+    and its errors are inf.
+
+    Parameters
+    ----------
+    f: callable
+        Function to fit parameters to.
+        Has to have format f(x, param1, param2, ...) and broadcast like numpy ufuncs,
+        parameters are passed as (K, 1) columns.
+    xdata: M-length sequence or (K, M) array
+        X values shared by all datasets or one row per dataset.
+    ydata: (K, M) array
+        Y values, one row per dataset.
+    p0: None, N-length sequence or (K, N) array
+        Initial guess shared by all datasets or one row per dataset.
+        If None, it is estimated from every dataset for the built-in models,
+        other models start at 1 like in curve_fit.
+    sigma: None, M-length sequence, (K, M) array or (K, M, M) array
+        Determines the uncertainty of ydata, standard deviations shared by all datasets or one
+        row per dataset, or covariance matrices of the datasets. A covariance matrix shared by
+        all datasets is passed as (1, M, M) array.
+    absolute_sigma: bool
+        Same meaning as in curve_fit.
+    max_iter: int
+        Maximal number of iterations.
+    ftol: float
+        Relative change of the sum of squares at which a dataset is considered converged.
+    xtol: float
+        Relative change of the parameters at which a dataset is considered converged.
+    linear: None or bool
+        Whether f is linear in its parameters, then all datasets are solved directly
+        without iterating. If None, only the polynomial models are treated as linear.
+    """
+
+    def __init__(self, f, xdata, ydata, p0=None, sigma=None, absolute_sigma=False,
+                 max_iter=200, ftol=1e-8, xtol=1e-8, linear=None):
+        ydata = np.atleast_2d(np.asarray(ydata, dtype=float))
+        xdata = np.asarray(xdata, dtype=float)
+        n_sets = len(ydata)
+
+        if linear is None:
+            linear = f in _LINEAR_MODELS
+
+        if linear:
+            params, cov = _linear_least_squares(f, xdata, ydata, sigma, absolute_sigma)
+            converged = np.ones(n_sets, dtype=bool)
+        else:
+            params, cov, converged = _levenberg_marquardt_batch(
+                f, xdata, ydata, p0, sigma, absolute_sigma, max_iter, ftol, xtol
+            )
+
+        self.f = f
+        self.params = params
+        self.cov = cov
+        self.errors = np.sqrt(np.einsum("kii->ki", cov))
+        self.success = converged & np.all(np.isfinite(cov), axis=(1, 2))
+        self.xdata = xdata
+        self.ydata = ydata
+
+    def __len__(self):
+        return len(self.params)
+
+    def __getitem__(self, i):
+        """
+        Result of the i-th dataset, data are views into the batch arrays.
+        """
+        xdata = self.xdata[i] if self.xdata.ndim == 2 else self.xdata
+        return FitResult(self.f, self.params[i], self.cov[i], xdata, self.ydata[i])
+
+    def __call__(self, x):
+        """
+        Evaluates all fitted curves in x, returns (K, len(x)) array.
+        """
+        return _eval_batch(self.f, np.asarray(x, dtype=float), self.params)
+
+
+def _levenberg_marquardt_batch(f, xdata, ydata, p0, sigma, absolute_sigma, max_iter, ftol, xtol):
+    """
+    Vectorized Levenberg-Marquardt iteration over all rows of ydata.
+    Returns (K, N) parameters, (K, N, N) covariances and which datasets converged.
+    """
+    n_sets, n_points = ydata.shape
+    if p0 is None:
+        p0 = _estimate_p0(f, xdata, ydata)
+    n_params = _n_params(f) if p0 is None else np.shape(p0)[-1]
+
+    if p0 is None:
+        p0 = np.ones(n_params)
+    params = np.array(np.broadcast_to(p0, (n_sets, n_params)), dtype=float)
+
+    whiten = _whitening(sigma, n_sets)
+
+    def rows(a, idx):
+        return a[idx] if a.ndim == 2 and len(a) == n_sets else a
+
+    def residuals(idx, p):
+        values = _eval_batch(f, rows(xdata, idx), p)
+        return values, whiten(values - ydata[idx], idx, True)
+
+    _, res = residuals(np.arange(n_sets), params)
+    cost = np.sum(res ** 2, axis=1)
+    damping = np.full(n_sets, 1e-3)
+    active = np.ones(n_sets, dtype=bool)
+    eye = np.eye(n_params)
+
+    for _ in range(max_iter):
+        idx = np.flatnonzero(active)
+        if idx.size == 0:
+            break
+
+        p = params[idx]
+        values, res = residuals(idx, p)
+        jac = whiten(_jacobian_batch(f, rows(xdata, idx), p, values), idx, False)
+
+        jac_t = np.swapaxes(jac, 1, 2)
+        jtj = jac_t @ jac
+        grad = (jac_t @ res[:, :, np.newaxis])[:, :, 0]
+        diag = np.einsum("kii->ki", jtj)
+        lhs = jtj + damping[idx, np.newaxis, np.newaxis] * (diag[:, :, np.newaxis] * eye + 1e-12 * eye)
+        step = -np.linalg.solve(lhs, grad[:, :, np.newaxis])[:, :, 0]
+
+        trial = p + step
+        _, trial_res = residuals(idx, trial)
+        trial_cost = np.sum(trial_res ** 2, axis=1)
+
+        accept = np.isfinite(trial_cost) & (trial_cost <= cost[idx])
+        params[idx[accept]] = trial[accept]
+        damping[idx] = np.where(accept, np.maximum(damping[idx] / 10, 1e-12), damping[idx] * 10)
+
+        cost_change = np.abs(cost[idx] - trial_cost) <= ftol * cost[idx]
+        step_change = np.linalg.norm(step, axis=1) <= xtol * (np.linalg.norm(p, axis=1) + xtol)
+        converged = accept & (cost_change | step_change) | (damping[idx] > 1e16)
+        cost[idx[accept]] = trial_cost[accept]
+        active[idx[converged]] = False
+
+    all_sets = np.arange(n_sets)
+    values, _ = residuals(all_sets, params)
+    jac = whiten(_jacobian_batch(f, xdata, params, values), all_sets, False)
+    cov, rank = _covariance_batch(jac)
+
+    if not absolute_sigma:
+        if n_points > n_params:
+            cov *= (cost / (n_points - n_params))[:, np.newaxis, np.newaxis]
+        else:
+            cov.fill(np.inf)
+    cov[rank < n_params] = np.inf
+
+    return params, cov, ~active
+
+
+def _whitening(sigma, n_sets):
+    """
+    Returns whiten(a, idx, vectors) scaling the residuals (vectors=True, (k, M) rows) or
+    jacobians ((k, M, N) or shared (M, N)) of datasets idx by the uncertainties.
+    sigma is None, M-length or (K, M) standard deviations, or (K, M, M) or (1, M, M)
+    covariance matrices, which are whitened by their Cholesky factors like in curve_fit.
+    """
+    if sigma is None:
+        return lambda a, idx, vectors: a
+
+    sigma = np.asarray(sigma, dtype=float)
+    if sigma.ndim == 3:
+        lower = np.linalg.cholesky(sigma)
+
+        def whiten(a, idx, vectors):
+            return _solve_lower(lower[idx] if len(lower) == n_sets else lower, a, vectors)
+    else:
+        weights = 1 / np.atleast_2d(sigma)
+
+        def whiten(a, idx, vectors):
+            w = weights[idx] if len(weights) == n_sets else weights
+            return a * (w if vectors else w[:, :, np.newaxis])
+
+    return whiten
+
+
+def _solve_lower(lower, a, vectors):
+    """
+    Solves lower @ z = a for (C, M, M) lower triangular matrices, C is 1 or the number of rows
+    of a. a are (K, M) vectors, or (M, N) or (K, M, N) matrices.
+    """
+    if vectors:
+        a = a[..., np.newaxis]
+
+    if len(lower) > 1:
+        a = np.broadcast_to(a, (len(lower),) + a.shape[-2:])
+        z = np.stack([solve_triangular(l, a_i, lower=True) for l, a_i in zip(lower, a)])
+    elif a.ndim == 2:
+        z = solve_triangular(lower[0], a, lower=True)
+    else:
+        k, m, n = a.shape
+        z = solve_triangular(lower[0], np.moveaxis(a, 0, 1).reshape(m, k * n), lower=True)
+        z = np.moveaxis(z.reshape(m, k, n), 1, 0)
+
+    return z[..., 0] if vectors else z
+
+
+def _linear_least_squares(f, xdata, ydata, sigma=None, absolute_sigma=False):
+    """
+    Direct weighted least squares solution for f linear in its parameters, no p0 needed.
+    Unless f is a known polynomial, the design matrix is obtained by evaluating f
+    with unit parameter vectors.
+    Returns (K, N) parameters and (K, N, N) covariances with the same meaning as in curve_fit.
+    """
+    n_sets, n_points = ydata.shape
+    n_params = _n_params(f)
+
+    if f in _LINEAR_MODELS:
+        design = _LINEAR_MODELS[f](xdata)
+        rhs = ydata
+    else:
+        unit = np.eye(n_params)
+        offset = np.broadcast_to(f(xdata, *np.zeros(n_params)), xdata.shape)
+        design = np.stack(
+            [np.broadcast_to(f(xdata, *unit[j]), xdata.shape) - offset for j in range(n_params)],
+            axis=-1
+        )
+        rhs = ydata - offset
+
+    if np.ndim(sigma) == 3:
+        whiten = _whitening(sigma, n_sets)
+        design = whiten(design, np.arange(n_sets), False)
+        rhs = whiten(rhs, np.arange(n_sets), True)
+    elif sigma is not None:
+        weights = 1 / np.asarray(sigma, dtype=float)
+        design = design * weights[..., np.newaxis]
+        rhs = rhs * weights
+
+    if design.ndim == 2:
+        q, r = qr(design, mode="economic")
+        qty = (q.T @ rhs.T).T
+        r = np.broadcast_to(r, (n_sets, n_params, n_params))
+    else:
+        q, r = np.linalg.qr(np.broadcast_to(design, (n_sets, n_points, n_params)))
+        qty = np.einsum("kmn,km->kn", q, rhs)
+
+    diag = np.abs(np.einsum("kii->ki", r))
+    singular = np.any(diag <= np.finfo(float).eps * max(n_points, n_params) * diag.max(axis=1, keepdims=True), axis=1)
+    safe_r = np.where(singular[:, np.newaxis, np.newaxis], np.eye(n_params), r)
+
+    params = np.linalg.solve(safe_r, qty[:, :, np.newaxis])[:, :, 0]
+    r_inv = np.linalg.inv(safe_r)
+    cov = r_inv @ np.swapaxes(r_inv, 1, 2)
+
+    if not absolute_sigma:
+        if n_points > n_params:
+            fitted = (design @ params[:, :, np.newaxis])[:, :, 0]
+            chi2 = np.sum((rhs - fitted) ** 2, axis=1)
+            cov *= (chi2 / (n_points - n_params))[:, np.newaxis, np.newaxis]
+        else:
+            cov.fill(np.inf)
+    cov[singular] = np.inf
+
+    return params, cov
+
+
+def _covariance_batch(jac):
+    """
+    Moore-Penrose inverse of J^T J for every dataset, same as curve_fit does for one.
+    Returns the covariance matrices and the ranks of the jacobians.
+    """
+    _, s, vt = np.linalg.svd(jac, full_matrices=False)
+    threshold = np.finfo(float).eps * max(jac.shape[1:]) * s[:, :1]
+    kept = s > threshold
+    inv_s2 = np.where(kept, 1 / np.where(kept, s, 1) ** 2, 0)
+
+    return np.einsum("kni,kn,knj->kij", vt, inv_s2, vt), kept.sum(axis=1)
+
+
+FitJob = namedtuple("FitJob", "f xdata ydata kwargs", defaults=(None,))
+FitJob.__doc__ = """
+One fit for fit_parallel, kwargs are passed to FitCurve.
+f has to be picklable, e.g. a module level function.
+"""
+
+_shared_data = None
+
+
+def _attach_shared_data(name):
+    """
+    Process pool initializer, attaches the worker to the shared block of fit data.
+    """
+    global _shared_data
+    _shared_data = shared_memory.SharedMemory(name=name)
+
+
+def _shared_array(layout):
+    offset, shape, dtype = layout
+    return np.ndarray(shape, dtype=dtype, buffer=_shared_data.buf, offset=offset)
+
+
+def _fit_shared_job(f, x_layout, y_layout, kwargs):
+    xdata = _shared_array(x_layout)
+    ydata = _shared_array(y_layout)
+    try:
+        return _fit(f, xdata, ydata, **kwargs)
+    finally:
+        del xdata, ydata
+
+
+def fit_parallel(jobs, workers=None):
+    """
+    Fits many independent datasets, possibly with different functions, in a process pool.
+    Data of all jobs are shared with the workers through one shared memory block
+    instead of being pickled for every job. Arrays keep their shape and dtype, so
+    multivariate xdata of shape (k, M) are fitted the same as by FitCurve.
+
+    Parameters
+    ----------
+    jobs: sequence of FitJob or (f, xdata, ydata[, kwargs]) tuples
+        Fits to do, f has to be picklable.
+    workers: int, optional
+        Number of processes, defaults to the number of CPUs.
+
+    Returns
+    -------
+    results: list
+        FitCurve objects in the same order as jobs. If a job fails, the raised
+        exception is in its place instead and the other jobs are not affected.
+    """
+    jobs = [FitJob(*job) for job in jobs]
+    if not jobs:
+        return []
+
+    arrays = []
+    layouts = []
+    offset = 0
+    for job in jobs:
+        job_layouts = []
+        for values in (job.xdata, job.ydata):
+            values = np.asarray(values)
+            if values.dtype.hasobject:
+                values = values.astype(float)
+            layout = (offset, values.shape, values.dtype)
+            arrays.append((values, layout))
+            job_layouts.append(layout)
+            # keeps every array aligned for any dtype
+            offset += -(-values.nbytes // 16) * 16
+        layouts.append(job_layouts)
+
+    block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    try:
+        for values, (array_offset, shape, dtype) in arrays:
+            target = np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=array_offset)
+            target[...] = values
+            del target
+
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_attach_shared_data,
+                                 initargs=(block.name,)) as executor:
+            futures = [
+                executor.submit(_fit_shared_job, job.f, x_layout, y_layout, job.kwargs or {})
+                for job, (x_layout, y_layout) in zip(jobs, layouts)
+            ]
+
+            results = []
+            for job, future in zip(jobs, futures):
+                try:
+                    params, cov = future.result()
+                except Exception as e:
+                    results.append(e)
+                else:
+                    results.append(FitCurve._from_fit(job.f, params, cov, job.xdata, job.ydata))
+    finally:
+        block.close()
+        block.unlink()
+
+    return results
 
 
 class Spline(UnivariateSpline):
     """
     Thin wrapper around the scipy's UnivariateSpline. Original data is saved in xdata, ydata.
     Curve function was added. Objects are callable.
-    If passed x array is not strictly increasing, raises a warning and monotonizes
-    the data automaticaly.
+    If passed x array is not strictly increasing (or not increasing for s > 0),
+    raises a warning and monotonizes the data automaticaly, see monotonize.
 
     Parameters
     ----------
@@ -140,30 +1070,54 @@ class Spline(UnivariateSpline):
         x data
     y: Sequence like
         y data
+    monotonize: str
+        Strategy of monotonize used for not increasing x, "drop", "sort" or "average".
+    cache: FitCache, optional
+        If given, the spline is loaded from the cache when the data and
+        parameters did not change.
     and other params of UnivariateSpline.
     """
 
-    def __init__(self, x, y, *args, **kwargs):
-        try:
-            super().__init__(self, x, y, *args, **kwargs)
-        except ValueError as e:
-            if str(e) == "x must be strictly increasing":
-                warnings.warn("Spline: ValueError catched, monotonizing!")
-
-                mono_x, mono_y = self._monotonize(x, y)
-                super().__init__(
-                    self, mono_x, mono_y, *args, **kwargs
-                )
-            else:
-                raise e
+    def __init__(self, x, y, *args, monotonize="drop", cache=None, **kwargs):
+        if cache is not None:
+            try:
+                key = cache.key(type(self), x, y, args, monotonize, kwargs)
+            except _UncacheableError as e:
+                warnings.warn(f"Spline: {e}, fitting without the cache")
+                cache = None
+
+        if cache is not None:
+            state = cache.load(key)
+            if state is not None:
+                self.__dict__.update(state)
+                self.xdata = np.array(x)
+                self.ydata = np.array(y)
+                return
+
+        spline_x, spline_y = np.asarray(x), np.asarray(y)
+        s = kwargs.get("s", args[3] if len(args) > 3 else None)
+        steps = np.diff(spline_x)
+        if not np.all(steps > 0 if s == 0 else steps >= 0):
+            warnings.warn("Spline: x is not strictly increasing, monotonizing!")
+            spline_x, spline_y = self._monotonize(spline_x, spline_y, monotonize)
+
+        super().__init__(spline_x, spline_y, *args, **kwargs)
+
+        if cache is not None:
+            cache.store(key, dict(self.__dict__))
 
         self.xdata = np.array(x)
         self.ydata = np.array(y)
 
-    def curve(self, start=None, end=None, resolution=100, overrun=0):
+    def _curve_state(self):
+        knots, coefficients, degree = self._eval_args
+        return knots.tobytes(), np.asarray(coefficients).tobytes(), degree
+
+    def curve(self, start=None, end=None, resolution=100, overrun=0, tolerance=None, max_res=10000):
         """
         Calculates the curve of the spline, used as line of theoretical function
         or a lead for an eye.
+        The last calculated curve is remembered and returned again for the same arguments.
 
         Parameters
         ----------
@@ -176,27 +1130,16 @@ class Spline(UnivariateSpline):
         overrun: float, (float, float)
             fraction of x interval to add before start and after end. If tuple,
             the values are used for start and end separately.
+        tolerance: float, optional
+            If given, points are placed adaptively instead of resolution evenly spaced ones,
+            so that linear interpolation between them deviates from the curve
+            by less than tolerance times the y range of the curve.
+        max_res: int
+            Maximal number of points of the adaptive sampling.
         """
-        if start is None:
-            start = self.xdata.min()
-        if end is None:
-            end = self.xdata.max()
-
-        interval_length = end - start
-
-        try:
-            start -= overrun[0] * interval_length
-            end += overrun[1] * interval_length
-        except TypeError:
-            start -= overrun * interval_length
-            end += overrun * interval_length
+        return _curve(self, start, end, resolution, overrun, tolerance, max_res)
 
-        xes = np.linspace(start, end, resolution)
-        ys = self(xes)
-
-        return xes, ys
-
-    def _monotonize(self, xdata, ydata):
+    def _monotonize(self, xdata, ydata, strategy="drop"):
         """
         Helper function to make passed x and y value array strictly increasing.
         New in 0.1.2
@@ -207,6 +1150,8 @@ class Spline(UnivariateSpline):
             X points
         ydata: sequence
             Y points
+        strategy: str
+            See monotonize.
 
         Returns:
         --------
@@ -215,14 +1160,50 @@ class Spline(UnivariateSpline):
         new_y: numpy.ndarray
             monotonized Y points
         """
-        highest = xdata[0] - 1
-        new_x = []
-        new_y = []
+        return monotonize(xdata, ydata, strategy)
+
+
+def monotonize(xdata, ydata, strategy="drop"):
+    """
+    Makes x values strictly increasing, vectorized.
+
+    Parameters
+    ----------
+    xdata: sequence
+        X points
+    ydata: sequence
+        Y points
+    strategy: str
+        "drop" keeps only points with x higher than all previous ones,
+        "sort" sorts the points by x and keeps the first of points with equal x,
+        "average" sorts the points by x and averages y of points with equal x.
+
+    Returns
+    -------
+    new_x: numpy.ndarray
+        monotonized X points
+    new_y: numpy.ndarray
+        monotonized Y points
+    """
+    xdata = np.asarray(xdata)
+    ydata = np.asarray(ydata)
+
+    if strategy == "drop":
+        keep = np.empty(len(xdata), dtype=bool)
+        keep[:1] = True
+        keep[1:] = xdata[1:] > np.maximum.accumulate(xdata)[:-1]
+        return xdata[keep], ydata[keep]
+
+    if strategy not in ("sort", "average"):
+        raise ValueError(f"Unknown monotonize strategy {strategy}")
+
+    order = np.argsort(xdata, kind="stable")
+    sorted_x = xdata[order]
+    sorted_y = ydata[order]
+    starts = np.flatnonzero(np.r_[True, sorted_x[1:] != sorted_x[:-1]])
 
-        for x, y in zip(xdata, ydata):
-            if x > highest:
-                new_x.append(x)
-                new_y.append(y)
-                highest = x
+    if strategy == "sort":
+        return sorted_x[starts], sorted_y[starts]
 
-        return np.array(new_x), np.array(new_y)
+    counts = np.diff(np.r_[starts, len(sorted_x)])
+    return sorted_x[starts], np.add.reduceat(sorted_y, starts) / counts
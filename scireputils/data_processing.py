@@ -1,4 +1,5 @@
 import numpy as np
+import pandas as pd
 
 
 def repeated_measurement_mean_and_error(values):
@@ -23,3 +24,110 @@ def repeated_measurement_mean_and_error(values):
     mean_error = single_value_error / np.sqrt(len(array))
 
     return mean, mean_error
+
+
+class RepeatedMeasurementAccumulator:
+    """
+    Incremental version of repeated_measurement_mean_and_error for streams of values,
+    uses Welford's algorithm with O(1) memory. Accumulators of separate chunks
+    (e.g. from different workers) can be merged.
+
+    Parameters
+    ----------
+    values : sequence, optional
+        initial values
+    """
+
+    def __init__(self, values=()):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.update(values)
+
+    def add(self, value):
+        """
+        Adds a single value.
+        """
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    def update(self, values):
+        """
+        Adds a chunk of values, the chunk is reduced with numpy and merged.
+        """
+        array = np.asarray(values, dtype=float).ravel()
+        if array.size == 0:
+            return
+
+        chunk = RepeatedMeasurementAccumulator()
+        chunk.count = array.size
+        chunk.mean = array.mean()
+        chunk._m2 = np.sum((array - chunk.mean) ** 2)
+        self.merge(chunk)
+
+    def merge(self, other):
+        """
+        Adds all values of another accumulator (Chan's parallel algorithm).
+        """
+        if other.count == 0:
+            return
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self._m2 += other._m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+
+    @property
+    def std(self):
+        """
+        Standard deviation (ddof=1) of the values.
+        """
+        if self.count < 2:
+            return np.nan
+        return np.sqrt(self._m2 / (self.count - 1))
+
+    @property
+    def mean_error(self):
+        """
+        Error of the mean, eg. std (ddof=1) of values divided by sqrt of number of values.
+        """
+        return self.std / np.sqrt(self.count)
+
+    def mean_and_error(self):
+        """
+        Returns
+        -------
+        mean : float
+            mean of the values
+        mean_error : float
+            error of the mean, same as in repeated_measurement_mean_and_error
+        """
+        return self.mean, self.mean_error
+
+
+def grouped_mean_and_error(df, column, by):
+    """
+    Vectorized repeated_measurement_mean_and_error of a dataframe column for every group.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+    column : str
+        name of the column with the measured values
+    by : str or list of str
+        column(s) identifying the measured quantity
+
+    Returns
+    -------
+    pd.DataFrame indexed by the groups with columns mean, mean_error and count
+    """
+    stats = df.groupby(by)[column].agg(["mean", "std", "count"])
+
+    return pd.DataFrame({
+        "mean": stats["mean"],
+        "mean_error": stats["std"] / np.sqrt(stats["count"]),
+        "count": stats["count"],
+    })
@@ -1,4 +1,93 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import numpy as np
 import pandas as pd
+from pandas._libs.parsers import STR_NA_VALUES
+from pandas.api.types import is_float_dtype, is_integer_dtype, is_numeric_dtype, is_object_dtype, is_string_dtype
+
+from scireputils._cache_utils import _atomic_open
+from scireputils._cache_utils import _file_sha256
+
+_DEFAULT_SEPARATOR = r"\s*,\s*"
+
+# options which may refer to column names, which are not stripped yet while the C engine parses
+_COLUMN_NAME_OPTIONS = {"usecols", "dtype", "converters", "parse_dates", "na_values"}
+
+
+def _strip_trailing_whitespace(df, na_values=STR_NA_VALUES):
+    """
+    Removes whitespace the C engine leaves before commas and at line ends
+    from column names, index and string columns, in place. Missing value tokens
+    followed by whitespace are only recognized after stripping, such columns are
+    then converted to numbers if all their other values are numbers.
+    """
+    df.columns = [c.strip() if isinstance(c, str) else c for c in df.columns]
+    if isinstance(df.index.name, str):
+        df.index.name = df.index.name.strip()
+    if is_object_dtype(df.index.dtype) or is_string_dtype(df.index.dtype):
+        df.index = df.index.str.rstrip()
+
+    for i, dtype in enumerate(df.dtypes):
+        if is_object_dtype(dtype) or is_string_dtype(dtype):
+            column = df.iloc[:, i].str.rstrip()
+            missing = column.isin(na_values)
+            if missing.any():
+                column = column.mask(missing)
+                try:
+                    column = pd.to_numeric(column.astype(object))
+                except (ValueError, TypeError):
+                    pass
+            df.isetitem(i, column)
+
+    return df
+
+
+def _csv_reading(index_col, sep, header, names, fast, kwargs):
+    """
+    Chooses the pandas engine for dataframe_from_csv, returns read_csv options
+    and a function finishing the parsed dataframe (or chunk).
+    """
+    separator = r"\s+" if sep == ' ' else sep
+    options = dict(skip_blank_lines=True,
+                   index_col=index_col,
+                   comment="#",
+                   header=header,
+                   names=names,
+                   **kwargs)
+
+    def finish(df):
+        return df
+
+    if fast and separator == r"\s+":
+        options.update(sep=separator, engine="c")
+
+    elif fast and separator == _DEFAULT_SEPARATOR and not _COLUMN_NAME_OPTIONS & set(kwargs):
+        options.update(sep=",", engine="c", skipinitialspace=True, index_col=None)
+
+        if not kwargs.get("na_filter", True):
+            na_values = ()
+        else:
+            na_values = STR_NA_VALUES if kwargs.get("keep_default_na", True) else ()
+
+        def finish(df):
+            df = _strip_trailing_whitespace(df, na_values)
+            if index_col is None or index_col is False:
+                return df
+
+            index_cols = index_col if isinstance(index_col, (list, tuple)) else [index_col]
+            return df.set_index([df.columns[c] if isinstance(c, int) else c for c in index_cols])
+
+    else:
+        options.update(sep=separator, engine="python")
+
+    return options, finish
 
 
 def dataframe_from_csv(csv_path: str,
@@ -6,18 +95,281 @@ def dataframe_from_csv(csv_path: str,
                        sep=r"\s*,\s*",
                        header=0,
                        names=None,
+                       fast=False,
+                       cache_dir=None,
+                       mmap=False,
                        **kwargs):
     """
     Creates Pandas dataframe from comma separated values file, allows # comments and
     blank lines.
+
+    If fast is True and the separator is the default one or ' ', the file is parsed
+    by the much faster pandas C engine instead of the python engine. Whitespace around
+    commas is then skipped by the parser and stripped from names and strings afterwards.
+    Other separators and options referring to columns (usecols, dtype, converters,
+    parse_dates, na_values) always use the python engine.
+
+    If cache_dir is given (e.g. the data directory of the report project), the parsed
+    columns are saved there as .npy files and loaded from them next time, as long as
+    the csv file and the parameters did not change. With mmap, numeric columns of
+    a cached dataframe are read-only memory maps instead of copies.
     """
+    options, finish = _csv_reading(index_col, sep, header, names, fast, kwargs)
 
-    separator = r"\s+" if sep == ' ' else sep
-    return pd.read_csv(csv_path, sep=separator,
-                       engine="python",
-                       skip_blank_lines=True,
-                       index_col=index_col,
-                       comment="#",
-                       header=header,
-                       names=names,
-                       **kwargs)
+    def read():
+        return finish(pd.read_csv(csv_path, **options))
+
+    if cache_dir is None:
+        return read()
+
+    return _cached_dataframe(csv_path, cache_dir, mmap, repr(sorted(options.items(), key=str)), read)
+
+
+def dataframe_chunks_from_csv(csv_path: str,
+                              chunksize=100_000,
+                              index_col=None,
+                              sep=r"\s*,\s*",
+                              header=0,
+                              names=None,
+                              fast=False,
+                              **kwargs):
+    """
+    Iterator variant of dataframe_from_csv, yields dataframes of at most chunksize rows
+    while the file is being read. Column types are inferred from the first chunk
+    and later chunks are converted to them. An integer column with missing values
+    in a later chunk is float from that chunk on, as if the whole file was read at once.
+    ValueError is raised if a later chunk does not fit otherwise (e.g. fractional
+    floats in a column of integers), pass dtype in that case, which implies the
+    python engine. Other parameters are the same as in dataframe_from_csv.
+    """
+    options, finish = _csv_reading(index_col, sep, header, names, fast, kwargs)
+    dtypes = None
+
+    with pd.read_csv(csv_path, chunksize=chunksize, **options) as reader:
+        for chunk in reader:
+            chunk = finish(chunk)
+
+            if dtypes is None:
+                dtypes = chunk.dtypes.copy()
+            else:
+                _convert_chunk_dtypes(chunk, dtypes)
+
+            yield chunk
+
+
+def _timed_dataframe_from_csv(path, kwargs):
+    start = time.perf_counter()
+    df = dataframe_from_csv(path, **kwargs)
+    return df, time.perf_counter() - start
+
+
+def load_directory(pattern,
+                   workers=None,
+                   processes=False,
+                   source_column="source",
+                   progress=None,
+                   **kwargs):
+    """
+    Loads all csv files matching a glob pattern (e.g. raw_data/*.csv) concurrently
+    with dataframe_from_csv and concatenates them into one dataframe.
+
+    Parameters
+    ----------
+    pattern : str
+        glob pattern of the files, ** is allowed, files are concatenated in sorted order
+    workers : int, optional
+        number of parallel workers, defaults to the executor's default
+    processes : bool
+        use processes instead of threads, useful for the python engine which holds the GIL,
+        threads are enough with fast=True
+    source_column : str or None
+        name of the added categorical column with the source file of every row, None for none
+    progress : callable, optional
+        called as progress(done, total, path) after every loaded file
+    kwargs
+        passed to dataframe_from_csv
+
+    Returns
+    -------
+    pd.DataFrame with attrs["load_timings"], a dict of parsing times of the files in seconds
+    and the total wall time under "total"
+    """
+    start = time.perf_counter()
+    paths = sorted(glob.glob(pattern, recursive=True))
+    if not paths:
+        raise FileNotFoundError(f"No files match {pattern}")
+
+    executor_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    frames = [None] * len(paths)
+    timings = {}
+
+    with executor_class(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_timed_dataframe_from_csv, path, kwargs): i for i, path in enumerate(paths)
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            i = futures[future]
+            frames[i], timings[paths[i]] = future.result()
+            if progress is not None:
+                progress(done, len(paths), paths[i])
+
+    if source_column is not None:
+        sources = pd.Categorical.from_codes(
+            np.repeat(np.arange(len(paths)), [len(f) for f in frames]),
+            categories=paths
+        )
+
+    df = pd.concat(frames, ignore_index=kwargs.get("index_col") is None)
+    if source_column is not None:
+        df[source_column] = sources
+
+    timings["total"] = time.perf_counter() - start
+    df.attrs["load_timings"] = timings
+    return df
+
+
+def _convert_chunk_dtypes(chunk, dtypes):
+    """
+    Converts columns of chunk to dtypes in place, raises ValueError if values would change.
+    Integer columns with missing values are widened to float, also in dtypes for the next chunks.
+    """
+    for i, (column, dtype) in enumerate(dtypes.items()):
+        values = chunk.iloc[:, i]
+        if values.dtype == dtype:
+            continue
+
+        if is_integer_dtype(dtype) and is_float_dtype(values.dtype) and values.isna().any():
+            present = values.dropna()
+            if (present == np.round(present)).all():
+                dtype = np.dtype(float)
+                dtypes.iloc[i] = dtype
+
+        try:
+            converted = values.astype(dtype)
+        except (TypeError, ValueError) as e:
+            raise ValueError(
+                f"Column {column} can not be converted to {dtype} inferred from the first chunk"
+            ) from e
+
+        if is_numeric_dtype(dtype) and is_numeric_dtype(values.dtype):
+            if not ((converted == values) | values.isna()).all():
+                raise ValueError(
+                    f"Values of column {column} would change by conversion to {dtype} "
+                    f"inferred from the first chunk"
+                )
+
+        chunk.isetitem(i, converted)
+
+
+_CACHE_META = "meta.json"
+
+
+def _cached_dataframe(csv_path, cache_dir, mmap, options_repr, read):
+    """
+    Loads the dataframe from the column cache of csv_path in cache_dir, or reads it
+    by read() and saves the cache. The cache is valid while the csv has the same size
+    and modification time, or the same content hash if only the time changed.
+    """
+    csv_path = os.path.abspath(csv_path)
+    key = hashlib.sha256(f"{csv_path}\n{options_repr}".encode()).hexdigest()[:16]
+    entry = os.path.join(cache_dir, f"{os.path.basename(csv_path)}.{key}")
+    meta_path = os.path.join(entry, _CACHE_META)
+    stat = os.stat(csv_path)
+
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        meta = None
+
+    if meta is not None and meta["size"] == stat.st_size:
+        if meta["mtime_ns"] != stat.st_mtime_ns and meta["sha256"] == _file_sha256(csv_path):
+            meta["mtime_ns"] = stat.st_mtime_ns
+            with _atomic_open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+        if meta["mtime_ns"] == stat.st_mtime_ns:
+            return _load_columns(entry, meta, mmap)
+
+    df = read()
+    _save_columns(df, entry, {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": _file_sha256(csv_path),
+    })
+    return df
+
+
+def _save_array(directory, name, values):
+    """
+    Saves a column as .npy, returns its dtype name for restoring. Extension types
+    (e.g. pandas strings) are saved as object arrays, which can not be memory mapped.
+    """
+    if isinstance(values.dtype, np.dtype) and not values.dtype.hasobject:
+        np.save(os.path.join(directory, name), values.to_numpy())
+    else:
+        np.save(os.path.join(directory, name), values.to_numpy(dtype=object), allow_pickle=True)
+    return str(values.dtype)
+
+
+def _load_array(directory, name, dtype, mmap):
+    path = os.path.join(directory, name + ".npy")
+    try:
+        array = np.load(path, mmap_mode="r" if mmap else None)
+    except ValueError:
+        array = np.load(path, allow_pickle=True)
+
+    if array.dtype.hasobject:
+        return pd.array(array, dtype=dtype)
+    return array.view(np.ndarray)
+
+
+def _save_columns(df, entry, meta):
+    """
+    Saves columns and index of df with meta into cache directory entry, atomically replacing it.
+    Dataframes with labels not representable in json are not cached.
+    """
+    cache_dir = os.path.dirname(entry)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=cache_dir)
+
+    try:
+        meta["columns"] = list(df.columns)
+        meta["dtypes"] = [_save_array(tmp, f"c{i}", df.iloc[:, i]) for i in range(df.shape[1])]
+
+        if isinstance(df.index, pd.RangeIndex) and df.index.name is None:
+            meta["range_index"] = [df.index.start, df.index.stop, df.index.step]
+        else:
+            meta["index_names"] = list(df.index.names)
+            meta["index_dtypes"] = [
+                _save_array(tmp, f"i{i}", df.index.get_level_values(i).to_series())
+                for i in range(df.index.nlevels)
+            ]
+
+        with open(os.path.join(tmp, _CACHE_META), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+    except TypeError:
+        shutil.rmtree(tmp)
+        return
+
+    shutil.rmtree(entry, ignore_errors=True)
+    os.replace(tmp, entry)
+
+
+def _load_columns(entry, meta, mmap):
+    if "range_index" in meta:
+        index = pd.RangeIndex(*meta["range_index"])
+    else:
+        levels = [
+            _load_array(entry, f"i{i}", dtype, mmap) for i, dtype in enumerate(meta["index_dtypes"])
+        ]
+        if len(levels) == 1:
+            index = pd.Index(levels[0], name=meta["index_names"][0])
+        else:
+            index = pd.MultiIndex.from_arrays(levels, names=meta["index_names"])
+
+    columns = {
+        i: _load_array(entry, f"c{i}", dtype, mmap) for i, dtype in enumerate(meta["dtypes"])
+    }
+    df = pd.DataFrame(columns, index=index, copy=False)
+    df.columns = meta["columns"]
+    return df
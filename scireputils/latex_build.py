@@ -0,0 +1,422 @@
+import argparse
+import glob
+import json
+import os
+import subprocess
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from scireputils._cache_utils import _atomic_open
+from scireputils._cache_utils import _file_sha256
+
+_LATEX_COMMAND = [
+    "-file-line-error",
+    "-interaction=nonstopmode",
+    "-synctex=1",
+    "-output-format=pdf",
+    "-recorder",
+]
+
+_OPEN_PDF_COMMAND = [
+    "sumatrapdf",
+]
+
+# files written by pdflatex that do not feed back into the next run
+_NOT_AUX_EXTENSIONS = (".pdf", ".log", ".fls", ".synctex", ".synctex.gz", ".synctex(busy)", ".build.json")
+
+BuildResult = namedtuple("BuildResult", "pdf_path runs skipped returncode log_path")
+ReportJob = namedtuple("ReportJob", "name template_path variables", defaults=(None,))
+ReportResult = namedtuple("ReportResult", "name pdf_path runs skipped returncode log_path seconds error")
+
+
+class LatexBuildError(RuntimeError):
+    """
+    Raised when pdflatex fails, the message points to the log.
+    """
+
+
+def build_latex(latex_path,
+                output_dir=None,
+                aux_dir=None,
+                include_dirs=(),
+                jobname=None,
+                max_runs=5,
+                force=False,
+                open_pdf=False,
+                quiet=False,
+                check=True,
+                latex="pdflatex",
+                timeout=None):
+    """
+    Compiles a latex file to pdf only if any of its inputs changed since the last build.
+    Inputs are all files pdflatex reads (\\input tables, figures, class files...), as recorded
+    in the .fls file of the last build, and are compared by size, modification time and sha256.
+    Pdflatex is rerun until the .aux, .toc and similar files stop changing, so that references
+    and labels are resolved.
+
+    Parameters
+    ----------
+    latex_path : str
+        Path to the latex .tex file
+    output_dir : str, optional
+        Directory for the pdf, default is the directory of the latex file
+    aux_dir : str, optional
+        Directory for the auxiliary files (MiKTeX only), default is output_dir
+    include_dirs : sequence of str
+        Directories searched for inputs and class files
+    jobname : str, optional
+        Name of the resulting pdf without extension, default is the name of the latex file
+    max_runs : int
+        Maximal number of pdflatex runs to reach stable auxiliary files
+    force : bool
+        Compile even if nothing changed
+    open_pdf : bool
+        Open the pdf in a viewer after the build, False runs headless
+    quiet : bool
+        Hide the pdflatex output, it is still in the log file
+    check : bool
+        Raise LatexBuildError if pdflatex fails
+    latex : str
+        The latex executable
+    timeout : float, optional
+        Seconds after which a pdflatex run is killed, subprocess.TimeoutExpired is raised
+
+    Returns
+    -------
+    BuildResult
+        pdf path, number of pdflatex runs, whether the build was skipped, return code of the
+        last run and path to the log
+    """
+    latex_path = os.path.abspath(latex_path)
+    output_dir = os.path.abspath(output_dir or os.path.dirname(latex_path))
+    aux_dir = os.path.abspath(aux_dir or output_dir)
+    jobname = jobname or os.path.splitext(os.path.basename(latex_path))[0]
+    include_dirs = [os.path.abspath(d) for d in include_dirs]
+    for directory in (output_dir, aux_dir):
+        os.makedirs(directory, exist_ok=True)
+
+    command = [latex] + _LATEX_COMMAND + [f"-output-directory={output_dir}", f"-jobname={jobname}"]
+    if aux_dir != output_dir:
+        command.append(f"-aux-directory={aux_dir}")
+    command += [f"-include-directory={d}" for d in include_dirs]
+    command.append(latex_path)
+
+    pdf_path = os.path.join(output_dir, jobname + ".pdf")
+    record_path = os.path.join(aux_dir, jobname + ".build.json")
+    record = _load_record(record_path)
+
+    if not force and _is_up_to_date(record, command, pdf_path):
+        result = BuildResult(pdf_path, 0, True, 0, _find_job_file((aux_dir, output_dir), jobname, ".log"))
+    else:
+        result = _run_until_stable(command, pdf_path, record_path, record, jobname, (aux_dir, output_dir),
+                                   include_dirs, max_runs, quiet, timeout)
+
+    if check and result.returncode != 0:
+        raise LatexBuildError(f"{latex} failed on {latex_path} with code {result.returncode}, see {result.log_path}")
+
+    if open_pdf:
+        subprocess.run(_OPEN_PDF_COMMAND + [pdf_path])
+
+    return result
+
+
+def _run_until_stable(command, pdf_path, record_path, record, jobname, dirs, include_dirs, max_runs, quiet, timeout):
+    env = dict(os.environ)
+    if include_dirs:
+        # TeX Live ignores -include-directory, a trailing separator keeps the default search path
+        env["TEXINPUTS"] = os.pathsep.join(include_dirs + [env.get("TEXINPUTS", "")])
+        if not env["TEXINPUTS"].endswith(os.pathsep):
+            env["TEXINPUTS"] += os.pathsep
+
+    stdout = subprocess.DEVNULL if quiet else None
+    aux_paths = set(record.get("aux", ())) | set(_job_files(dirs, jobname))
+    aux = _hash_files(aux_paths)
+
+    runs = 0
+    returncode = 0
+    inputs, outputs = [], []
+    while runs < max_runs:
+        returncode = subprocess.run(command, env=env, stdout=stdout, timeout=timeout).returncode
+        runs += 1
+
+        inputs, outputs = _read_fls(_find_job_file(dirs, jobname, ".fls"))
+        aux_paths |= {path for path in outputs if not path.endswith(_NOT_AUX_EXTENSIONS)}
+        new_aux = _hash_files(aux_paths)
+        if returncode != 0 or new_aux == aux:
+            break
+        aux = new_aux
+
+    if returncode == 0:
+        written = set(outputs)
+        new_record = {
+            "command": command,
+            "inputs": _file_states((path for path in inputs if path not in written), record.get("inputs", {})),
+            "aux": sorted(aux_paths),
+            "pdf": _file_states([pdf_path]).get(pdf_path),
+        }
+        with _atomic_open(record_path, "w", encoding="utf-8") as f:
+            json.dump(new_record, f, indent=2)
+    elif os.path.exists(record_path):
+        os.remove(record_path)
+
+    return BuildResult(pdf_path, runs, False, returncode, _find_job_file(dirs, jobname, ".log"))
+
+
+def _load_record(record_path):
+    try:
+        with open(record_path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _is_up_to_date(record, command, pdf_path):
+    if not record or record.get("command") != command:
+        return False
+
+    try:
+        stat = os.stat(pdf_path)
+    except OSError:
+        return False
+    if not record.get("pdf") or record["pdf"][:2] != [stat.st_size, stat.st_mtime_ns]:
+        return False
+
+    for path, state in record["inputs"].items():
+        try:
+            if _file_state(path, state)[2] != state[2]:
+                return False
+        except OSError:
+            return False
+
+    return True
+
+
+def _file_state(path, previous=None):
+    """
+    [size, mtime_ns, sha256] of a file, the hash is only computed if size or mtime differ from previous.
+    """
+    stat = os.stat(path)
+    if previous and previous[:2] == [stat.st_size, stat.st_mtime_ns]:
+        return previous
+    return [stat.st_size, stat.st_mtime_ns, _file_sha256(path)]
+
+
+def _file_states(paths, previous=None):
+    previous = previous or {}
+    states = {}
+    for path in paths:
+        if os.path.isfile(path):
+            states[path] = _file_state(path, previous.get(path))
+    return states
+
+
+def _hash_files(paths):
+    return {path: _file_sha256(path) for path in paths if os.path.isfile(path)}
+
+
+def _job_files(dirs, jobname):
+    paths = []
+    for directory in dirs:
+        for path in glob.glob(os.path.join(glob.escape(directory), glob.escape(jobname) + ".*")):
+            if not path.endswith(_NOT_AUX_EXTENSIONS):
+                paths.append(path)
+    return paths
+
+
+def _find_job_file(dirs, jobname, extension):
+    for directory in dirs:
+        path = os.path.join(directory, jobname + extension)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _read_fls(fls_path):
+    """
+    Absolute paths of INPUT and OUTPUT files listed in a pdflatex -recorder file, without duplicates.
+    """
+    inputs, outputs = {}, {}
+    if fls_path is None:
+        return [], []
+
+    pwd = os.getcwd()
+    with open(fls_path, encoding="utf-8", errors="surrogateescape") as f:
+        for line in f:
+            kind, _, path = line.rstrip("\n").partition(" ")
+            if kind == "PWD":
+                pwd = path
+            elif kind in ("INPUT", "OUTPUT"):
+                path = os.path.normpath(os.path.join(pwd, path))
+                (inputs if kind == "INPUT" else outputs)[path] = None
+
+    return list(inputs), list(outputs)
+
+
+def build_reports(jobs,
+                  build_dir,
+                  include_dirs=(),
+                  workers=None,
+                  timeout=None,
+                  max_runs=5,
+                  force=False,
+                  latex="pdflatex",
+                  progress=None):
+    """
+    Renders and compiles many documents in parallel. Every job gets its own directory
+    build_dir/name with latex, output and auxiliary subdirectories, so that the jobs
+    do not overwrite each other's auxiliary files. Failing jobs do not stop the others.
+
+    Parameters
+    ----------
+    jobs : iterable of ReportJob
+        name of the job (used for its directory), path to the latex template and dict of
+        variables for latex_templates.render_template
+    build_dir : str
+        Directory for the job directories
+    include_dirs : sequence of str
+        Directories searched for inputs and class files, shared by all jobs
+    workers : int, optional
+        Number of documents compiled at once, default is the number of cpus
+    timeout : float, optional
+        Seconds after which a pdflatex run is killed and its job fails
+    max_runs, force, latex
+        see build_latex
+    progress : callable, optional
+        called as progress(done, total, result) after every finished job
+
+    Returns
+    -------
+    list of ReportResult in the order of jobs, error is None or the text of the exception
+    """
+    jobs = [ReportJob(*job) for job in jobs]
+    names = [job.name for job in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError("Names of the jobs have to be unique")
+
+    options = dict(include_dirs=include_dirs, timeout=timeout, max_runs=max_runs, force=force, latex=latex)
+    results = [None] * len(jobs)
+
+    # pdflatex runs in its own process, threads only wait for it
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = {executor.submit(_build_report, job, build_dir, options): i for i, job in enumerate(jobs)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            results[futures[future]] = future.result()
+            if progress is not None:
+                progress(done, len(jobs), future.result())
+
+    return results
+
+
+def _build_report(job, build_dir, options):
+    from scireputils.latex_templates import render_template
+
+    start = time.perf_counter()
+    job_dir = os.path.abspath(os.path.join(build_dir, job.name))
+    latex_dir = os.path.join(job_dir, "latex")
+    output_dir = os.path.join(job_dir, "output")
+    aux_dir = os.path.join(job_dir, "auxiliary")
+    pdf_path = os.path.join(output_dir, job.name + ".pdf")
+
+    try:
+        os.makedirs(latex_dir, exist_ok=True)
+        latex_path = os.path.join(latex_dir, os.path.basename(job.template_path))
+        render_template(job.template_path, latex_path, **(job.variables or {}))
+        result = build_latex(latex_path, output_dir=output_dir, aux_dir=aux_dir, jobname=job.name,
+                             quiet=True, check=False, **options)
+    except subprocess.TimeoutExpired:
+        error = f"pdflatex timed out after {options['timeout']:g} s"
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    else:
+        error = None if result.returncode == 0 else f"pdflatex failed with code {result.returncode}"
+        return ReportResult(job.name, result.pdf_path, result.runs, result.skipped, result.returncode,
+                            result.log_path, time.perf_counter() - start, error)
+
+    log_path = _find_job_file((aux_dir, output_dir), job.name, ".log")
+    return ReportResult(job.name, pdf_path, None, False, None, log_path, time.perf_counter() - start, error)
+
+
+def format_build_summary(results):
+    """
+    Table of the jobs of build_reports with their status, number of pdflatex runs and time.
+    """
+    width = max([len(r.name) for r in results] + [3])
+    lines = [f"{'job':<{width}}  {'status':<8} {'runs':>4} {'time [s]':>9}"]
+    for r in results:
+        status = "failed" if r.error else "skipped" if r.skipped else "built"
+        runs = "" if r.runs is None else r.runs
+        lines.append(f"{r.name:<{width}}  {status:<8} {runs:>4} {r.seconds:>9.2f}")
+
+    failed = [r for r in results if r.error]
+    total = sum(r.seconds for r in results)
+    lines.append(f"{len(results)} jobs, {len(failed)} failed, {total:.2f} s of compilation")
+    for r in failed:
+        lines.append(f"\n{r.name}: {r.error.rstrip()}\nlog: {r.log_path}")
+
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Incremental pdflatex build, compiles only if an input changed.")
+    parser.add_argument("latex_path", help="the .tex file to compile")
+    parser.add_argument("--output-dir", help="directory for the pdf")
+    parser.add_argument("--aux-dir", help="directory for the auxiliary files")
+    parser.add_argument("--include-dir", action="append", default=[], help="input search directory, repeatable")
+    parser.add_argument("--jobname", help="name of the pdf without extension")
+    parser.add_argument("--max-runs", type=int, default=5, help="maximal number of pdflatex runs")
+    parser.add_argument("--force", action="store_true", help="compile even if nothing changed")
+    parser.add_argument("--open", action="store_true", help="open the pdf in a viewer")
+    parser.add_argument("--quiet", action="store_true", help="hide the pdflatex output")
+    args = parser.parse_args(argv)
+
+    try:
+        result = build_latex(args.latex_path,
+                             output_dir=args.output_dir,
+                             aux_dir=args.aux_dir,
+                             include_dirs=args.include_dir,
+                             jobname=args.jobname,
+                             max_runs=args.max_runs,
+                             force=args.force,
+                             open_pdf=args.open,
+                             quiet=args.quiet)
+    except LatexBuildError as e:
+        print(e)
+        return 1
+
+    if result.skipped:
+        print(f"{result.pdf_path} is up to date")
+    else:
+        print(f"{result.pdf_path} built in {result.runs} run(s)")
+    return 0
+
+
+def build_reports_main(argv=None):
+    parser = argparse.ArgumentParser(description="Renders and compiles many reports in parallel.")
+    parser.add_argument("jobs", help="json file with a list of jobs {\"name\": ..., \"template\": ..., \"variables\": {...}}")
+    parser.add_argument("--build-dir", default="build", help="directory for the job directories")
+    parser.add_argument("--include-dir", action="append", default=[], help="input search directory, repeatable")
+    parser.add_argument("-j", "--workers", type=int, help="number of parallel jobs, default is the number of cpus")
+    parser.add_argument("--timeout", type=float, help="seconds after which a pdflatex run is killed")
+    parser.add_argument("--force", action="store_true", help="compile even if nothing changed")
+    args = parser.parse_args(argv)
+
+    with open(args.jobs, encoding="utf-8") as f:
+        jobs = [ReportJob(job["name"], job["template"], job.get("variables")) for job in json.load(f)]
+
+    start = time.perf_counter()
+    results = build_reports(jobs,
+                            args.build_dir,
+                            include_dirs=args.include_dir,
+                            workers=args.workers,
+                            timeout=args.timeout,
+                            force=args.force,
+                            progress=lambda done, total, r: print(f"[{done}/{total}] {r.name}"))
+    print(format_build_summary(results))
+    print(f"wall time {time.perf_counter() - start:.2f} s")
+
+    return 1 if any(r.error for r in results) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,35 +1,165 @@
+import hashlib
+import itertools
+import json
 import os
-import subprocess
+import weakref
 from collections import namedtuple
 
 import jinja2
+import jinja2.meta
 import numpy as np
-from pandas import DataFrame
-
+from pandas import Series
+
+from scireputils._cache_utils import _atomic_open
+from scireputils._dataframe_to_booktabs_table import _add_uncertainty_format
+from scireputils._dataframe_to_booktabs_table import _format_array_values
+from scireputils._dataframe_to_booktabs_table import _format_column_values
+from scireputils._dataframe_to_booktabs_table import _format_values_with_errors
+from scireputils._dataframe_to_booktabs_table import _formatted_width
+from scireputils._dataframe_to_booktabs_table import _join_columns
 from scireputils._dataframe_to_booktabs_table import _make_column_strings_equal_length
 from scireputils._dataframe_to_booktabs_table import _make_formater_from_s_col_format_string
 from scireputils._dataframe_to_booktabs_table import _parse_column_property
+from scireputils.latex_build import build_latex
+
+# TODO think about keeping paths in project_wide.py
+_OUTPUT_DIR = os.path.join("..", "output")
+_AUXILIARY_DIR = os.path.join("..", "auxiliary")
+_INCLUDE_DIRS = [os.path.join("..", "classfiles"), os.path.join("..", "latex")]
+
+_LATEX_JINJA_OPTIONS = dict(
+    block_start_string=r'\BLOCK{',
+    block_end_string='}',
+    variable_start_string=r'\VAR{',
+    variable_end_string='}',
+    comment_start_string=r'\#{',
+    comment_end_string='}',
+    line_statement_prefix='%%',
+    line_comment_prefix='%#',
+    trim_blocks=True,
+    autoescape=False,
+)
+
+_JINJA_ENVIRONMENTS = {}
+# templates are replaced by new objects when their file changes
+_REFERENCED_TEMPLATES = weakref.WeakKeyDictionary()
+
+
+def latex_jinja_environment(template_dir, bytecode_cache_dir=None):
+    """
+    Returns the jinja2 environment with latex friendly syntax for templates in a directory.
+    The environment is created once per directory and reused, so that the templates are
+    parsed only once. Compiled templates are also cached on disk between runs.
+
+    Parameters
+    ----------
+    template_dir : str
+        Directory with the templates
+    bytecode_cache_dir : str, optional
+        Directory for the compiled templates, default is the system temporary directory
+
+    Returns
+    -------
+    jinja2.Environment
+    """
+    key = (os.path.abspath(template_dir), bytecode_cache_dir and os.path.abspath(bytecode_cache_dir))
+    if key not in _JINJA_ENVIRONMENTS:
+        if bytecode_cache_dir:
+            os.makedirs(bytecode_cache_dir, exist_ok=True)
+        _JINJA_ENVIRONMENTS[key] = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(key[0]),
+            bytecode_cache=jinja2.FileSystemBytecodeCache(bytecode_cache_dir),
+            **_LATEX_JINJA_OPTIONS
+        )
+
+    return _JINJA_ENVIRONMENTS[key]
+
+
+def _get_template(template_path, jinja_env=None):
+    template_dir, template_name = os.path.split(template_path)
+    if jinja_env is None:
+        jinja_env = latex_jinja_environment(template_dir)
 
-_LATEX_COMMAND = [
-    "pdflatex",
-    "-file-line-error",
-    "-interaction=nonstopmode",
-    "-synctex=1",
-    "-output-format=pdf",
-    "-output-directory=../output",
-    "-aux-directory=../auxiliary",
-    "-include-directory=../classfiles",
-    "-include-directory=../latex",  # TODO think about keeping paths in project_wide.py
-]
+    template = jinja_env.get_template(template_name)
+    return template, template_name, _template_dependencies(jinja_env, template)
 
-_OPEN_PDF_COMMAND = [
-    "sumatrapdf",
-]
 
+def _template_dependencies(jinja_env, template):
+    """
+    Sha256 of the template file and of the templates it includes or extends by constant names.
+    """
+    if template not in _REFERENCED_TEMPLATES:
+        source = jinja_env.loader.get_source(jinja_env, template.name)[0]
+        _REFERENCED_TEMPLATES[template] = [
+            name for name in jinja2.meta.find_referenced_templates(jinja_env.parse(source)) if name is not None
+        ]
+    names = [template.name] + _REFERENCED_TEMPLATES[template]
+
+    dependencies = {}
+    for name in names:
+        source, filename, _ = jinja_env.loader.get_source(jinja_env, name)
+        dependencies[filename or name] = hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+    return dependencies
+
+
+def _dependencies_path(output_path):
+    return f"{output_path}.deps.json"
+
+
+def _write_rendered(template, template_name, dependencies, output_path, variables):
+    """
+    Renders the template and writes it atomically, unless the file already has the same content.
+    Template and variable hashes are recorded in a json file next to the output.
+    Returns the output path and whether it was written.
+    """
+    if os.path.isdir(output_path):
+        output_path = os.path.join(output_path, template_name)
 
-def render_template(template_path: str, output_path: str, **variables):
+    rendered = template.render(section1='Long Form', section2='Short Form', **variables).encode("utf-8")
+    record = {
+        "templates": dependencies,
+        "variables": hashlib.sha256(json.dumps(variables, sort_keys=True, default=repr).encode("utf-8")).hexdigest(),
+        "output": hashlib.sha256(rendered).hexdigest(),
+    }
+
+    deps_path = _dependencies_path(output_path)
+    try:
+        with open(deps_path, encoding="utf-8") as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        previous = {}
+
+    try:
+        stat = os.stat(output_path)
+        # the recorded size and mtime tell whether the file was touched since the last render
+        unchanged = (previous.get("output"), previous.get("size"), previous.get("mtime_ns")) == (
+            record["output"], stat.st_size, stat.st_mtime_ns
+        )
+        if not unchanged and stat.st_size == len(rendered):
+            with open(output_path, "rb") as f:
+                unchanged = f.read() == rendered
+    except OSError:
+        unchanged = False
+
+    if not unchanged:
+        with _atomic_open(output_path, "wb") as out:
+            out.write(rendered)
+
+    stat = os.stat(output_path)
+    record.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+    if record != previous:
+        with _atomic_open(deps_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=2)
+
+    return output_path, not unchanged
+
+
+def render_template(template_path: str, output_path: str, jinja_env=None, **variables):
     """
-    Renders a latex template into a compilable latex file.
+    Renders a latex template into a compilable latex file. The file is only written if its content
+    changes, so that its modification time does not trigger needless latex rebuilds.
+    Hashes of the templates, variables and output are recorded in output_path + '.deps.json'.
 
     Parameters
     ----------
@@ -38,54 +168,83 @@ def render_template(template_path: str, output_path: str, **variables):
     output_path : str
         Destination of the rendered latex file, if only a directory is given, the name will be the same
         as the template
+    jinja_env : jinja2.Environment, optional
+        Environment to load the template from, template_path is then relative to its loader.
+        Default is the cached latex_jinja_environment of the template directory
     variables : dict
         Variables for the template
+
+    Returns
+    -------
+    bool
+        Whether the file was written
     """
-    template_dir, template_name = os.path.split(template_path)
+    template, template_name, dependencies = _get_template(template_path, jinja_env)
+    return _write_rendered(template, template_name, dependencies, output_path, variables)[1]
 
-    if os.path.isdir(output_path):
-        output_path = os.path.join(output_path, template_name)
 
-    latex_jinja_env = jinja2.Environment(
-        block_start_string=r'\BLOCK{',
-        block_end_string='}',
-        variable_start_string=r'\VAR{',
-        variable_end_string='}',
-        comment_start_string=r'\#{',
-        comment_end_string='}',
-        line_statement_prefix='%%',
-        line_comment_prefix='%#',
-        trim_blocks=True,
-        autoescape=False,
-        loader=jinja2.FileSystemLoader(os.path.abspath(template_dir))
-    )
+def render_templates(template_path: str, outputs, jinja_env=None):
+    """
+    Renders one latex template with many sets of variables, the template is compiled only once.
 
-    template = latex_jinja_env.get_template(template_name)
-    rendered = template.render(section1='Long Form', section2='Short Form', **variables)
+    Parameters
+    ----------
+    template_path : str
+        Path to the template
+    outputs : dict or iterable of pairs
+        Maps destinations of the rendered latex files to dicts of variables for the template,
+        destinations are handled the same as in render_template
+    jinja_env : jinja2.Environment, optional
+        Environment to load the template from, see render_template
 
-    with open(output_path, "w+", encoding="utf-8") as out:
-        out.write(rendered)
+    Returns
+    -------
+    dict
+        Paths of the rendered files mapped to whether they were written
+    """
+    template, template_name, dependencies = _get_template(template_path, jinja_env)
+    if hasattr(outputs, "items"):
+        outputs = outputs.items()
+
+    return dict(
+        _write_rendered(template, template_name, dependencies, output_path, variables)
+        for output_path, variables in outputs
+    )
 
 
-def compile_latex_to_pdf(latex_path, pdf_path):
+def compile_latex_to_pdf(latex_path, pdf_path, open_pdf=True, force=False):
     """
-    Compiles given latex file to pdf using pdflatex. Then opens the final pdf.
+    Compiles given latex file to pdf using pdflatex, if any of its inputs changed since the last
+    compilation, see latex_build.build_latex. Then opens the final pdf.
     Parameters
     ----------
     latex_path : str
         path to the latex .tex file
     pdf_path : str
         path to the resulting .pdf file or output directory (the name will be the same as the .tex file)
+    open_pdf : bool
+        open the pdf in a viewer, False for headless builds
+    force : bool
+        compile even if nothing changed
 
+    Returns
+    -------
+    latex_build.BuildResult
     """
-    latex_dir, latex_name = os.path.split(latex_path)
-
     if os.path.isdir(pdf_path):
-        latex_name_wo_ext = os.path.splitext(latex_name)[0]
-        pdf_path = os.path.join(pdf_path, latex_name_wo_ext + ".pdf")
+        output_dir, jobname = pdf_path, None
+    else:
+        output_dir, pdf_name = os.path.split(pdf_path)
+        jobname = os.path.splitext(pdf_name)[0]
 
-    subprocess.run(_LATEX_COMMAND + [latex_path])
-    subprocess.run(_OPEN_PDF_COMMAND + [pdf_path])
+    return build_latex(latex_path,
+                       output_dir=output_dir or _OUTPUT_DIR,
+                       aux_dir=_AUXILIARY_DIR,
+                       include_dirs=_INCLUDE_DIRS,
+                       jobname=jobname,
+                       force=force,
+                       open_pdf=open_pdf,
+                       check=False)
 
 
 def make_figure_float(figure_path, label, caption, position="h", caption_vspace=0, width=None, scale=None,
@@ -195,7 +354,36 @@ def make_table_float(tabular_code,
 """
 
 
-def dataframe_to_booktabs_table(df, column_properties, file=None):
+def _prepare_column(df, column_property):
+    """
+    Returns column type, quantity name and unit header cells, the column series and
+    its float formatter for one column of dataframe_to_booktabs_table.
+    """
+    col_name, quantity_name, unit, s_col_format = _parse_column_property(column_property)
+
+    if col_name == "index":
+        series = Series(df.index.values)
+    else:
+        series = df[col_name]
+    s_column = series.dtype.name != "object"
+
+    if s_column:
+        col_type = f"S[table-format={s_col_format}]"
+    else:
+        col_type = "l"
+
+    float_format = _make_formater_from_s_col_format_string(
+        s_col_format
+    ) if s_col_format else None
+
+    if s_column:
+        quantity_name = f"{{{quantity_name}}}"
+        unit = f"{{{unit}}}"
+
+    return col_type, quantity_name, unit, series, float_format
+
+
+def dataframe_to_booktabs_table(df, column_properties, file=None, errors=None, error_digits=1):
     """
     Parameters
     ----------
@@ -209,8 +397,14 @@ def dataframe_to_booktabs_table(df, column_properties, file=None):
             optional_S_col_fmt_str
         ]
         S column formater examples: 1.2, 4.3e1
-    file : str
-        path to file to save this in. Default is None - no saving
+    file : str or file object
+        path to file or open text file to save this in. Default is None - no saving
+    errors : dict, optional
+        maps names of columns to names of columns with their uncertainties, such columns
+        are formatted as value \\pm error rounded to the significant digits of the error.
+        Without S column format string the table-format is derived from the values
+    error_digits : int
+        number of significant digits of the uncertainties
 
     Returns
     -------
@@ -219,43 +413,27 @@ def dataframe_to_booktabs_table(df, column_properties, file=None):
 
     columns = []
     col_types = []
+    errors = errors or {}
 
     for cp in column_properties:
-
-        col_name, quantity_name, unit, s_col_format = _parse_column_property(cp)
-
-        if col_name == "index":
-            from pandas import Series
-            series = Series(df.index.values)
-        else:
-            series = df[col_name]
-        s_column = series.dtype.name != "object"
-
-        if s_column:
-            col_type = f"S[table-format={s_col_format}]"
-            col_types.append(col_type)
+        col_type, quantity_name, unit, series, float_format = _prepare_column(df, cp)
+        col_name, _, _, s_col_format = _parse_column_property(cp)
+
+        if col_name in errors:
+            col_of_strings, table_format = _format_values_with_errors(
+                series.to_numpy(dtype=float), df[errors[col_name]].to_numpy(dtype=float), error_digits, float_format
+            )
+            if s_col_format:
+                table_format = _add_uncertainty_format(s_col_format, table_format)
+            col_type = f"S[table-format={table_format or '1.1'}]"
         else:
-            col_types.append("l")
-
-        float_format = _make_formater_from_s_col_format_string(
-            s_col_format
-        ) if s_col_format else None
-
-        col_of_strings = series.to_string(
-            index=False,
-            float_format=float_format
-        ).split("\n")
-
-        if s_column:
-            quantity_name = f"{{{quantity_name}}}"
-            unit = f"{{{unit}}}"
-
+            col_of_strings = _format_column_values(series, float_format)
+        col_types.append(col_type)
         finished_column_list = _make_column_strings_equal_length(quantity_name, unit, col_of_strings)
 
         columns.append(finished_column_list)
 
-    rows = zip(*columns)
-    concatenated_rows = [" & ".join(r) + r" \\" for r in rows]
+    concatenated_rows = _join_columns(columns)
 
     concatenated_rows[1] += r" \midrule"
     concatenated_rows[-1] += r" \bottomrule"
@@ -269,15 +447,109 @@ def dataframe_to_booktabs_table(df, column_properties, file=None):
 
     finished = "\n".join(header + concatenated_rows + footer)
 
-    if file:
+    if hasattr(file, "write"):
+        file.write(finished)
+    elif file:
         with open(file, "w+", encoding="utf-8") as f:
             f.write(finished)
 
     return finished
 
 
-_Column = namedtuple("Column", "values title unit format_str")
+def write_booktabs_table(chunks, column_properties, file, longtable=False):
+    """
+    Streaming variant of dataframe_to_booktabs_table for tables larger than memory,
+    the table is written chunk by chunk and only one chunk is held at a time.
+
+    Parameters
+    ----------
+    chunks : callable or iterable of pd.DataFrame
+        Parts of the table in order. If callable, it is called twice to get the chunks,
+        e.g. lambda: dataframe_chunks_from_csv(path), the first pass measures column
+        widths so that the output is aligned the same as from dataframe_to_booktabs_table.
+        An iterable is read only once and the columns are not aligned.
+        Float columns without S column format are formatted by pandas chunk by chunk.
+    column_properties : sequence of sequences of size 3 or 4
+        same as in dataframe_to_booktabs_table
+    file : str or file object
+        path to file or open text file to write the table to
+    longtable : bool
+        use the longtable environment, which breaks over pages and repeats the header
+    """
+    if callable(chunks):
+        widths = _measure_column_widths(chunks(), column_properties)
+        chunks = chunks()
+    else:
+        widths = [0] * len(column_properties)
+
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None:
+        raise ValueError("No chunks to write")
+
+    columns = [_prepare_column(first, cp) for cp in column_properties]
+    widths = [max(w, len(name), len(unit)) for w, (_, name, unit, _, _) in zip(widths, columns)]
+    environment = "longtable" if longtable else "tabular"
+
+    header = [f"\\begin{{{environment}}}{'' if longtable else '[t]'}{{"]
+    header += [f"  {col_type}" for col_type, *_ in columns]
+    if longtable:
+        header += ["}", r"\toprule"]
+    else:
+        header += [r"} \toprule"]
+    header += _join_columns([np.array([name.ljust(w)]) for w, (_, name, *_) in zip(widths, columns)])
+    header += [
+        row + r" \midrule"
+        for row in _join_columns([np.array([unit.ljust(w)]) for w, (_, _, unit, *_) in zip(widths, columns)])
+    ]
+    if longtable:
+        header += [r"\endhead", r"\bottomrule", r"\endfoot"]
+
+    f = file if hasattr(file, "write") else open(file, "w+", encoding="utf-8")
+    try:
+        f.write("\n".join(header))
+
+        pending = None
+        for chunk in itertools.chain([first], chunks):
+            rows = _join_columns([
+                np.char.rjust(np.asarray(_format_column_values(series, float_format), dtype=str), w)
+                for w, (_, _, _, series, float_format) in zip(widths, (_prepare_column(chunk, cp)
+                                                                     for cp in column_properties))
+            ])
+            if not rows:
+                continue
+
+            if pending is not None:
+                rows.insert(0, pending)
+            pending = rows.pop()
+            if rows:
+                f.write("\n" + "\n".join(rows))
+
+        if pending is not None:
+            f.write("\n" + pending + ("" if longtable else r" \bottomrule"))
+        f.write(f"\n\\end{{{environment}}}")
+    finally:
+        if f is not file:
+            f.close()
+
+
+def _measure_column_widths(chunks, column_properties):
+    """
+    First pass of write_booktabs_table, lengths of the longest formatted values of the columns.
+    """
+    widths = [0] * len(column_properties)
+
+    for chunk in chunks:
+        for i, cp in enumerate(column_properties):
+            _, _, _, series, float_format = _prepare_column(chunk, cp)
+            widths[i] = max(widths[i], _formatted_width(series, float_format))
+
+    return widths
+
+
+_Column = namedtuple("Column", "values title unit format_str errors error_digits", defaults=(None, 1))
 _SEPARATOR = "-"
+_SEPARATOR_DEFINITION = r"@{\hspace{4\tabcolsep}}"
 
 
 class BooktabsTable:
@@ -298,10 +570,10 @@ class BooktabsTable:
                  caption,
                  position="h",
                  tabcolsep=15,
-                 caption_vspace=0,):
-                 # toprule_pos=None,
-                 # midrule_pos=None,
-                 # bottomrule_pos=None):
+                 caption_vspace=0,
+                 toprule_pos=None,
+                 midrule_pos=None,
+                 bottomrule_pos=None):
         """
         Represents a latex booktabs table.
 
@@ -324,6 +596,8 @@ class BooktabsTable:
         bottomrule_pos : list, default [inf,]
             Indices of rows over which bottomrule should be drawn (inf means under last row)
 
+        Rows 0 and 1 are the quantity and unit header rows, the data starts at row 2.
+
         """
         self.columns = []
         self.label = label
@@ -331,15 +605,50 @@ class BooktabsTable:
         self.position = position
         self.tabcolsep = tabcolsep
         self.caption_vspace = caption_vspace
-        # self.toprule_pos = toprule_pos or [0, ]
-        # self.midrule_pos = midrule_pos or [2, ]
-        # self.bottomrule_pos = bottomrule_pos or [np.inf, ]
+        self.toprule_pos = toprule_pos or [0, ]
+        self.midrule_pos = midrule_pos or [2, ]
+        self.bottomrule_pos = bottomrule_pos or [np.inf, ]
 
-    def add_column(self, values, title="", unit="", format_str="1.1"):
-        self.columns.append(_Column(values, title, unit, format_str))
+    def add_column(self, values, title="", unit="", format_str=None, errors=None, error_digits=1):
+        """
+        Adds a column to the right side of the table.
 
-    # def add_separator(self):
-    #     self.columns.append(_SEPARATOR)
+        Parameters
+        ----------
+        values : array_like
+            Column data, numeric data makes an S column, strings make an l column
+        title : str
+            Name of the quantity in the column
+        unit : str
+            Unit of the quantity
+        format_str : str, optional
+            siunitx table-format of the S column, such as '1.3' or '2.2e1'. Default is '1.1',
+            for columns with errors it is derived from the rounded values
+        errors : array_like or float, optional
+            Uncertainties of the values, the cells are formatted as value \\pm error
+            rounded to the significant digits of the error
+        error_digits : int
+            Number of significant digits of the uncertainties
+
+        """
+        values = np.asarray(values)
+        if values.dtype == object:
+            # numbers mixed with None, like a pandas column would be
+            try:
+                values = values.astype(float)
+            except (TypeError, ValueError):
+                pass
+        if errors is not None:
+            errors = np.broadcast_to(np.asarray(errors, dtype=float), values.shape)
+        elif format_str is None:
+            format_str = "1.1"
+        self.columns.append(_Column(values, title, unit, format_str, errors, error_digits))
+
+    def add_separator(self):
+        """
+        Adds a wider gap between the previous and the next column.
+        """
+        self.columns.append(_SEPARATOR)
 
     def render(self):
         """
@@ -395,16 +704,65 @@ class BooktabsTable:
 
     def _render_tabular(self):
         """
-        This is a terrible hack using the function I had before to do the heavy lifting of actual table generation.
-        I need to rewrite this.
+        Renders the tabular environment directly from the column arrays.
+        Shorter columns are padded with empty cells.
         """
-        column_dict = {}
-        column_properties = []
+        n_data_rows = max((len(col.values) for col in self.columns if col is not _SEPARATOR), default=0)
+        col_types = []
+        columns = []
+
+        for col in self.columns:
+            if col is _SEPARATOR:
+                col_types.append(_SEPARATOR_DEFINITION)
+                continue
+
+            col_type, quantity_name, unit, col_of_strings = _prepare_array_column(col)
+            padding = np.full(n_data_rows - len(col_of_strings), "")
+            col_of_strings = np.concatenate([col_of_strings, padding])
+
+            col_types.append(col_type)
+            columns.append(_make_column_strings_equal_length(quantity_name, unit, col_of_strings))
+
+        rows = _join_columns(columns) if columns else []
+        # rules drawn over row i end the line above it, the column definitions close line for i == 0
+        lines = [r"\begin{tabular}[t]{"] + [f"  {ct}" for ct in col_types] + ["}"] + rows
+        first_row = len(col_types) + 2
+        for rule, positions in ((r"\toprule", self.toprule_pos),
+                                (r"\midrule", self.midrule_pos),
+                                (r"\bottomrule", self.bottomrule_pos)):
+            for pos in positions:
+                line = first_row - 1 + min(pos, len(rows))
+                lines[int(line)] += f" {rule}"
+        lines.append(r"\end{tabular}")
+
+        return "\n".join(lines)
 
-        for i, col in enumerate(self.columns):
-            column_dict[str(i)] = col.values
-            column_properties.append((str(i), col.title, col.unit, col.format_str))
 
-        return dataframe_to_booktabs_table(DataFrame(column_dict), column_properties)
+def _prepare_array_column(col):
+    """
+    Returns column type, quantity name and unit header cells and the formatted values
+    of one BooktabsTable column.
+    """
+    values = col.values
+    s_column = values.dtype.kind not in "OUS"
+    float_format = _make_formater_from_s_col_format_string(
+        col.format_str
+    ) if col.format_str else None
+    table_format = col.format_str
+
+    if col.errors is not None:
+        col_of_strings, derived_format = _format_values_with_errors(values, col.errors, col.error_digits, float_format)
+        if table_format:
+            table_format = _add_uncertainty_format(table_format, derived_format)
+        table_format = table_format or derived_format or "1.1"
+    elif len(values):
+        col_of_strings = _format_array_values(values, float_format)
+        if col_of_strings is None:
+            col_of_strings = _format_column_values(Series(values), float_format)
+    else:
+        col_of_strings = np.array([], dtype=str)
 
+    if s_column:
+        return f"S[table-format={table_format}]", f"{{{col.title}}}", f"{{{col.unit}}}", col_of_strings
 
+    return "l", col.title, col.unit, col_of_strings
@@ -1,7 +1,20 @@
+import contextlib
+import hashlib
+import json
 import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
 
 import matplotlib
 import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.texmanager import TexManager
+
+from scireputils._cache_utils import _UncacheableError
+from scireputils._cache_utils import _atomic_open
+from scireputils._cache_utils import _hash_value
+from scireputils.latex_templates import make_figure_float
 
 _MATPLOTLIB_LATEX_STYLE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "latex_style.mplstyle")
 
@@ -12,3 +25,506 @@ def matplotlib_use_latex_style():
 
 def matplotlib_restore_default_style():
     matplotlib.rcParams.update(matplotlib.rcParamsDefault)
+
+
+def use_tex_cache(cache_dir):
+    """
+    Makes matplotlib keep the TeX rendered strings of the latex style in cache_dir instead of
+    the user wide matplotlib cache, e.g. in the auxiliary directory of the project, so that
+    the cache can be kept with the project and shared by its builds.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory of the cache, created if it does not exist
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    # matplotlib has no public setting for the location, every TexManager method reads this
+    TexManager._cache_dir = Path(os.path.abspath(cache_dir))
+
+
+class TexCacheStats:
+    """
+    Counts of TeX rendered strings found in the matplotlib cache (hits) and rendered
+    by TeX (misses). entries are the (tex, fontsize, dpi) of all requested strings and
+    can be passed to warm_up_tex_cache in the next build.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.entries = []
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 1.0
+
+    def add(self, entry, hit):
+        self.entries.append(entry)
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def __repr__(self):
+        return f"TexCacheStats(hits={self.hits}, misses={self.misses}, hit_rate={self.hit_rate:.1%})"
+
+
+def _is_tex_cached(tex, fontsize, dpi=None):
+    extension = ".dvi" if dpi is None else ".png"
+    return os.path.exists(TexManager.get_basefile(tex, fontsize, dpi) + extension)
+
+
+def _render_tex(tex, fontsize, dpi=None):
+    if dpi is None:
+        TexManager.make_dvi(tex, fontsize)
+    else:
+        TexManager.make_png(tex, fontsize, dpi)
+
+
+@contextlib.contextmanager
+def tex_cache_statistics():
+    """
+    Context manager counting cache hits and misses of the TeX rendered strings drawn inside it,
+    in the current process.
+
+    Examples
+    --------
+    >>> with tex_cache_statistics() as stats:
+    ...     fig.savefig("plot.pdf")
+    >>> stats.hit_rate
+    """
+    stats = TexCacheStats()
+    originals = {name: vars(TexManager)[name] for name in ("make_dvi", "make_png")}
+    make_dvi, make_png = TexManager.make_dvi, TexManager.make_png
+    depth = [0]
+
+    def counted(make, dpi_given):
+        def wrapper(cls, tex, fontsize, *args):
+            # make_png renders through make_dvi, only the outer call is counted
+            if depth[0] == 0:
+                dpi = args[0] if dpi_given else None
+                stats.add((tex, fontsize, dpi), _is_tex_cached(tex, fontsize, dpi))
+            depth[0] += 1
+            try:
+                return make(tex, fontsize, *args)
+            finally:
+                depth[0] -= 1
+        return classmethod(wrapper)
+
+    TexManager.make_dvi = counted(make_dvi, False)
+    TexManager.make_png = counted(make_png, True)
+    try:
+        yield stats
+    finally:
+        for name, method in originals.items():
+            setattr(TexManager, name, method)
+
+
+def warm_up_tex_cache(strings, fontsize=None, dpi=None, workers=None):
+    """
+    Renders strings with TeX into the matplotlib cache concurrently, before the figures are
+    drawn, so that drawing does not wait for one TeX run per label. Use with the latex style
+    applied, the rendered strings depend on the preamble.
+
+    Parameters
+    ----------
+    strings : iterable
+        Strings as they are drawn (tick labels, axis labels, legends...), or (tex, fontsize)
+        and (tex, fontsize, dpi) tuples, e.g. entries of TexCacheStats of a previous build
+    fontsize : float, optional
+        Font size of plain strings, default is rcParams["font.size"]
+    dpi : float, optional
+        Also renders png images for raster output at this dpi, default only renders the dvi
+        files used by vector output
+    workers : int, optional
+        Number of TeX processes run at once, defaults to the number of cpus
+
+    Returns
+    -------
+    TexCacheStats of the strings, hits are the strings that were already cached
+    """
+    fontsize = fontsize or matplotlib.rcParams["font.size"]
+    entries = {}
+    for s in strings:
+        if isinstance(s, str):
+            s = (s, fontsize, dpi)
+        tex, size, entry_dpi = (tuple(s) + (dpi,))[:3]
+        if tex.strip():
+            entries[(tex, float(size), entry_dpi)] = None
+
+    stats = TexCacheStats()
+    missing = []
+    for entry in entries:
+        hit = _is_tex_cached(*entry)
+        stats.add(entry, hit)
+        if not hit:
+            missing.append(entry)
+
+    # TeX runs in its own process, threads only wait for it
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        for future in [executor.submit(_render_tex, *entry) for entry in missing]:
+            future.result()
+
+    return stats
+
+
+def axes_pixel_width(ax=None):
+    """
+    Width of the axes in pixels when the figure is saved, for vector formats these are the
+    pixels of the figure dpi.
+    """
+    ax = ax or plt.gca()
+    fig = ax.get_figure()
+    dpi = matplotlib.rcParams["savefig.dpi"]
+    if not isinstance(dpi, (int, float)):
+        dpi = fig.dpi
+    width_inches = ax.get_position().width * fig.get_figwidth()
+    return max(int(round(width_inches * dpi)), 1)
+
+
+def downsample(x, y, n_out, method="minmax"):
+    """
+    Reduces a trace to about n_out points while keeping its visual shape. Points with
+    non-finite values are dropped, x is sorted if it is not.
+
+    Parameters
+    ----------
+    x, y : array_like
+        The trace
+    n_out : int
+        For 'minmax' the number of pixel columns, the result has up to 2 * n_out + 2 points.
+        For 'lttb' the number of points of the result
+    method : str
+        'minmax' keeps the minimum and maximum of every pixel column, so that the envelope of
+        noisy traces is exact. 'lttb' (largest triangle three buckets) keeps the point of every
+        bucket forming the largest triangle with its neighbours, better for smooth curves
+
+    Returns
+    -------
+    x, y : np.ndarray
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    finite = np.isfinite(x) & np.isfinite(y)
+    if not finite.all():
+        x, y = x[finite], y[finite]
+    if x.size and (np.diff(x) < 0).any():
+        order = np.argsort(x, kind="stable")
+        x, y = x[order], y[order]
+
+    if method == "minmax":
+        limit = 2 * n_out + 2
+    elif method == "lttb":
+        limit = n_out
+    else:
+        raise ValueError(f"Unknown downsampling method {method}, use 'minmax' or 'lttb'")
+
+    if x.size <= max(limit, 3):
+        return x, y
+    if method == "minmax":
+        return _downsample_minmax(x, y, n_out)
+    return _downsample_lttb(x, y, n_out)
+
+
+def _downsample_minmax(x, y, n_columns):
+    edges = np.linspace(x[0], x[-1], n_columns + 1)
+    starts = np.unique(np.searchsorted(x, edges[:-1], side="left"))
+    starts = starts[starts < x.size]
+
+    kept = [np.array([0, x.size - 1])]
+    counts = np.diff(np.append(starts, x.size))
+    for reduce in (np.minimum, np.maximum):
+        extremes = np.repeat(reduce.reduceat(y, starts), counts)
+        candidates = np.flatnonzero(y == extremes)
+        # the first candidate of every column
+        column = np.searchsorted(starts, candidates, side="right")
+        kept.append(candidates[np.r_[True, column[1:] != column[:-1]]])
+
+    indices = np.unique(np.concatenate(kept))
+    return x[indices], y[indices]
+
+
+def _downsample_lttb(x, y, n_out):
+    # first and last points are kept, the rest is split into n_out - 2 buckets
+    edges = np.linspace(1, x.size - 1, n_out - 1).astype(int)
+    indices = np.empty(n_out, dtype=int)
+    indices[0], indices[-1] = 0, x.size - 1
+
+    previous = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        if i + 2 < n_out - 1:
+            next_x = x[edges[i + 1]:edges[i + 2]].mean()
+            next_y = y[edges[i + 1]:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+
+        area = np.abs((x[previous] - next_x) * (y[start:stop] - y[previous])
+                      - (x[previous] - x[start:stop]) * (next_y - y[previous]))
+        previous = start + int(area.argmax())
+        indices[i + 1] = previous
+
+    return x[indices], y[indices]
+
+
+def plot_downsampled(x=None, y=None, *args, ax=None, data=None, method="minmax", n_out=None, **kwargs):
+    """
+    Plots large traces like ax.plot, but only with the points visible at the resolution of the axes,
+    which keeps the saved figures small and fast to render.
+
+    Parameters
+    ----------
+    x : array_like or str, optional
+        x values or name of a column of data, default is the index of data or 0, 1, ... like in ax.plot
+    y : array_like, str or list of str
+        y values or name(s) of column(s) of data, every column is plotted with its name as label.
+        Like in ax.plot, a single positional argument is y, e.g. plot_downsampled(y) or
+        plot_downsampled('u', 'r-', data=df)
+    args
+        Format string and other positional arguments of ax.plot
+    ax : matplotlib.axes.Axes, optional
+        Default is the current axes
+    data : pd.DataFrame, optional
+        Dataframe with the columns, e.g. from dataframe_from_csv
+    method : str
+        'minmax' or 'lttb', see downsample
+    n_out : int, optional
+        See downsample, default is the width of the axes in pixels
+    kwargs
+        Passed to ax.plot
+
+    Returns
+    -------
+    list of matplotlib.lines.Line2D
+    """
+    if y is None or (isinstance(y, str) and (data is None or y not in data)):
+        if y is not None:
+            args = (y,) + args
+        x, y = None, x
+    if y is None:
+        raise TypeError("plot_downsampled: y values are missing")
+
+    ax = ax or plt.gca()
+    n_out = n_out or axes_pixel_width(ax)
+
+    if data is not None and x is None:
+        x = data.index.to_numpy()
+    elif data is not None and isinstance(x, str):
+        x = data[x].to_numpy()
+
+    if data is not None and isinstance(y, str):
+        traces = [(data[y].to_numpy(), y)]
+    elif data is not None and isinstance(y, (list, tuple)) and all(isinstance(c, str) for c in y):
+        traces = [(data[c].to_numpy(), c) for c in y]
+    else:
+        traces = [(y, None)]
+
+    if x is None:
+        x = np.arange(len(traces[0][0]))
+
+    lines = []
+    for values, label in traces:
+        line_kwargs = dict(kwargs)
+        if label is not None:
+            line_kwargs.setdefault("label", label)
+        lines += ax.plot(*downsample(x, values, n_out, method), *args, **line_kwargs)
+
+    return lines
+
+
+_FigureEntry = namedtuple("FigureEntry", "func args kwargs caption label float_kwargs")
+
+
+class FigureRegistry:
+    """
+    Collects plotting functions with their data and renders the figures into a directory
+    in parallel. A figure is rendered again only if the source of its function, its data,
+    the style or the saving options changed since the last render.
+
+    Parameters
+    ----------
+    plots_dir : str
+        Directory for the figure files, it should be in the graphicspath of the latex document
+    style : str, dict or None
+        Matplotlib style applied in the workers, default is the latex style of matplotlib_use_latex_style
+    file_format : str
+        Format of the figure files, such as 'pdf' or 'png'
+    savefig_kwargs : dict, optional
+        Passed to Figure.savefig, e.g. {"bbox_inches": "tight"}
+    tex_cache_dir : str, optional
+        Directory of the TeX rendered strings used by the workers, see use_tex_cache.
+        Default is the matplotlib cache
+    """
+    RECORD_NAME = ".figures.json"
+
+    def __init__(self, plots_dir, style=_MATPLOTLIB_LATEX_STYLE_PATH, file_format="pdf", savefig_kwargs=None,
+                 tex_cache_dir=None):
+        self.plots_dir = plots_dir
+        self.style = style
+        self.file_format = file_format
+        self.savefig_kwargs = savefig_kwargs or {}
+        self.tex_cache_dir = tex_cache_dir
+        self.figures = {}
+        self.rendered = []
+        self.tex_cache_stats = TexCacheStats()
+
+    def register(self, name, func, args=(), kwargs=None, caption="", label=None, **float_kwargs):
+        """
+        Registers a figure.
+
+        Parameters
+        ----------
+        name : str
+            Name of the figure file without extension
+        func : callable
+            Module level plotting function called as func(*args, **kwargs) in a worker process,
+            returns the matplotlib Figure or draws into the current figure and returns None
+        args : tuple
+            Data for the plotting function, must be picklable
+        kwargs : dict, optional
+            Keyword arguments of the plotting function
+        caption : str
+            Figure caption
+        label : str, optional
+            Figure label without fig:, default is the name
+        float_kwargs
+            Passed to make_figure_float, e.g. width or position
+        """
+        self.figures[name] = _FigureEntry(func, tuple(args), kwargs or {}, caption, label or name, float_kwargs)
+
+    def path(self, name):
+        return os.path.join(self.plots_dir, f"{name}.{self.file_format}")
+
+    def key(self, name):
+        """
+        Hash of the source of the plotting function, its data, the style and the saving options.
+        None if the function has no source, such figure is rendered every time.
+        """
+        entry = self.figures[name]
+        h = hashlib.sha256()
+        try:
+            for value in (entry.func, _hashable_data(entry.args), _hashable_data(entry.kwargs),
+                          self.file_format, self.savefig_kwargs):
+                _hash_value(h, value)
+        except _UncacheableError:
+            return None
+
+        if isinstance(self.style, str) and os.path.isfile(self.style):
+            with open(self.style, "rb") as f:
+                h.update(f.read())
+        else:
+            _hash_value(h, self.style)
+
+        return h.hexdigest()
+
+    def render(self, workers=None, force=False):
+        """
+        Renders the figures that changed in a process pool, each worker applies the style.
+        Names of the rendered figures are stored in the rendered attribute and the TeX cache
+        hits and misses of their labels in tex_cache_stats.
+
+        Parameters
+        ----------
+        workers : int, optional
+            Number of worker processes, defaults to the number of cpus
+        force : bool
+            Render all figures
+
+        Returns
+        -------
+        dict of names and make_figure_float snippets of all figures, in the order of registration
+        """
+        os.makedirs(self.plots_dir, exist_ok=True)
+        record_path = os.path.join(self.plots_dir, self.RECORD_NAME)
+        try:
+            with open(record_path, encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            record = {}
+
+        keys = {name: self.key(name) for name in self.figures}
+        outdated = [
+            name for name in self.figures
+            if force or keys[name] is None or record.get(name) != keys[name]
+            or not os.path.exists(self.path(name))
+        ]
+
+        errors = []
+        self.rendered = []
+        self.tex_cache_stats = TexCacheStats()
+        if outdated:
+            with ProcessPoolExecutor(max_workers=workers,
+                                     initializer=_init_figure_worker,
+                                     initargs=(self.style, self.tex_cache_dir)) as executor:
+                futures = {
+                    name: executor.submit(_render_figure, self.figures[name].func, self.figures[name].args,
+                                          self.figures[name].kwargs, self.path(name), self.file_format,
+                                          self.savefig_kwargs)
+                    for name in outdated
+                }
+                for name, future in futures.items():
+                    try:
+                        stats = future.result()
+                        self.tex_cache_stats.hits += stats.hits
+                        self.tex_cache_stats.misses += stats.misses
+                        self.tex_cache_stats.entries += stats.entries
+                        self.rendered.append(name)
+                        if keys[name] is None:
+                            record.pop(name, None)
+                        else:
+                            record[name] = keys[name]
+                    except Exception as e:
+                        record.pop(name, None)
+                        errors.append(e)
+
+            with _atomic_open(record_path, "w", encoding="utf-8") as f:
+                json.dump(record, f, indent=2)
+
+        if errors:
+            raise errors[0]
+
+        return {
+            name: make_figure_float(os.path.basename(self.path(name)), entry.label, entry.caption,
+                                    **entry.float_kwargs)
+            for name, entry in self.figures.items()
+        }
+
+
+def _hashable_data(value):
+    """
+    Replaces pandas objects by dicts of their labels and values, so that _hash_value sees the labels.
+    """
+    if hasattr(value, "columns") and hasattr(value, "index"):
+        return {"index": value.index.to_numpy(), "columns": {str(c): value[c].to_numpy() for c in value.columns}}
+    if hasattr(value, "to_numpy") and hasattr(value, "index"):
+        return {"index": value.index.to_numpy(), "name": str(value.name), "values": value.to_numpy()}
+    if isinstance(value, dict):
+        return {k: _hashable_data(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_hashable_data(v) for v in value)
+    return value
+
+
+def _init_figure_worker(style, tex_cache_dir):
+    plt.switch_backend("Agg")
+    if style is not None:
+        plt.style.use(style)
+    if tex_cache_dir is not None:
+        use_tex_cache(tex_cache_dir)
+
+
+def _render_figure(func, args, kwargs, path, file_format, savefig_kwargs):
+    with tex_cache_statistics() as stats:
+        fig = func(*args, **kwargs)
+        if fig is None:
+            fig = plt.gcf()
+
+        try:
+            with _atomic_open(path, "wb") as f:
+                fig.savefig(f, format=file_format, **savefig_kwargs)
+        finally:
+            plt.close(fig)
+
+    return stats
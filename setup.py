@@ -15,6 +15,8 @@ setup(
     entry_points={
         "console_scripts": [
             "scirep-init-report = scireputils.project_management:init_report_directory_executable",
+            "scirep-build = scireputils.latex_build:main",
+            "scirep-build-reports = scireputils.latex_build:build_reports_main",
         ],
     },
 )
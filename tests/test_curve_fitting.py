@@ -0,0 +1,52 @@
+import os
+
+import numpy as np
+import pytest
+
+from scireputils.curve_fitting import FitCache, FitCurve, f_line, fit_parallel
+
+
+def plane(x, a, b):
+    return a * x[0] + b * x[1]
+
+
+def test_fit_parallel_keeps_multivariate_xdata():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(2, 50))
+    y = plane(x, 2, 3) + rng.normal(0, 0.01, 50)
+
+    plane_fit, line_fit = fit_parallel([(plane, x, y), (f_line, np.arange(5), 2 * np.arange(5) + 1)], workers=2)
+
+    np.testing.assert_allclose(plane_fit.params, FitCurve(plane, x, y).params)
+    np.testing.assert_allclose(line_fit.params, [2, 1])
+
+
+def _make_line(k):
+    return lambda x, a: a * x + k
+
+
+def test_cache_keys_closures(tmp_path):
+    cache = FitCache(str(tmp_path))
+    x = np.arange(5.0)
+
+    first = FitCurve(_make_line(1), x, 3 * x + 1, cache=cache)
+    second = FitCurve(_make_line(2), x, 3 * x + 2, cache=cache)
+
+    assert cache.key(_make_line(1)) != cache.key(_make_line(2))
+    np.testing.assert_allclose(first.params, [3])
+    np.testing.assert_allclose(second.params, [3])
+
+
+def test_cache_refuses_functions_without_source(tmp_path):
+    cache = FitCache(str(tmp_path))
+    x = np.arange(5.0)
+    namespace = {}
+    exec("f1 = lambda x, a: a * x + 1\nf2 = lambda x, a: a * x + 2", namespace)
+
+    with pytest.warns(UserWarning, match="without the cache"):
+        FitCurve(namespace["f1"], x, 3 * x + 1, cache=cache)
+    with pytest.warns(UserWarning, match="without the cache"):
+        second = FitCurve(namespace["f2"], x, 3 * x + 2, cache=cache)
+
+    np.testing.assert_allclose(second.params, [3])
+    assert not os.listdir(tmp_path)
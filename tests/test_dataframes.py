@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from scireputils.dataframes import dataframe_chunks_from_csv, dataframe_from_csv
+
+
+def _write_csv(path):
+    path.write_text("# measurement\nt, u, name\n0, 1.5, a\n1, 2.5, b\n2, 3.5, c\n")
+
+
+def _is_memory_mapped(array):
+    while isinstance(array, np.ndarray):
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return False
+
+
+def test_cache_round_trip(tmp_path):
+    csv_path = tmp_path / "data.csv"
+    cache_dir = tmp_path / "cache"
+    _write_csv(csv_path)
+
+    first = dataframe_from_csv(str(csv_path), cache_dir=str(cache_dir))
+    assert len(os.listdir(cache_dir)) == 1
+
+    cached = dataframe_from_csv(str(csv_path), cache_dir=str(cache_dir), mmap=True)
+    pd.testing.assert_frame_equal(cached, first)
+    assert _is_memory_mapped(cached["u"].to_numpy())
+
+
+def test_cache_revalidated_by_content(tmp_path):
+    csv_path = tmp_path / "data.csv"
+    cache_dir = tmp_path / "cache"
+    _write_csv(csv_path)
+    first = dataframe_from_csv(str(csv_path), cache_dir=str(cache_dir))
+
+    stat = os.stat(csv_path)
+    os.utime(csv_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    cached = dataframe_from_csv(str(csv_path), cache_dir=str(cache_dir), mmap=True)
+    pd.testing.assert_frame_equal(cached, first)
+
+    csv_path.write_text("t, u, name\n0, 9.5, a\n1, 2.5, b\n2, 3.5, c\n")
+    changed = dataframe_from_csv(str(csv_path), cache_dir=str(cache_dir))
+    assert changed["u"].iloc[0] == 9.5
+
+
+def test_chunks_widen_integers_with_missing_values(tmp_path):
+    csv_path = tmp_path / "log.csv"
+    csv_path.write_text("t, n\n0, 1\n1, 2\n2, \n3, 4\n4, 5\n")
+
+    for fast in (False, True):
+        chunks = list(dataframe_chunks_from_csv(str(csv_path), chunksize=2, fast=fast))
+        assert [chunk["n"].dtype.kind for chunk in chunks] == ["i", "f", "f"]
+        np.testing.assert_array_equal(pd.concat(chunks)["n"], [1, 2, np.nan, 4, 5])
+
+
+def test_chunks_reject_fractional_integers(tmp_path):
+    csv_path = tmp_path / "log.csv"
+    csv_path.write_text("t, n\n0, 1\n1, 2\n2, \n3, 4.5\n")
+
+    with pytest.raises(ValueError):
+        list(dataframe_chunks_from_csv(str(csv_path), chunksize=2))
@@ -0,0 +1,19 @@
+import numpy as np
+import pandas as pd
+
+from scireputils.latex_templates import BooktabsTable, dataframe_to_booktabs_table
+
+
+def test_table_format_with_errors():
+    df = pd.DataFrame({"u": [1.234, 12.5, -123.4, 5.0], "du": [0.05, 0.25, np.nan, 0.012]})
+
+    derived = dataframe_to_booktabs_table(df, [["u", "U", "V"]], errors={"u": "du"})
+    assert "S[table-format=-3.2(1)]" in derived
+    assert "12.5 \\pm 0.3" in derived
+
+    given = dataframe_to_booktabs_table(df, [["u", "U", "V", "3.2"]], errors={"u": "du"})
+    assert "S[table-format=3.2(1)]" in given
+
+    table = BooktabsTable("tab", "U")
+    table.add_column(df["u"].to_numpy(), "U", "V", format_str="3.2", errors=df["du"].to_numpy())
+    assert "S[table-format=3.2(1)]" in table.render()
@@ -0,0 +1,36 @@
+import matplotlib
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pytest
+
+from scireputils.plotting import plot_downsampled
+
+
+@pytest.fixture
+def ax():
+    fig, ax = plt.subplots()
+    yield ax
+    plt.close(fig)
+
+
+def test_plot_downsampled_positional_y(ax):
+    y = np.sin(np.arange(10_000) / 100)
+    df = pd.DataFrame({"u": y, "v": -y})
+
+    line, = plot_downsampled(y, "r-", ax=ax)
+    assert line.get_color() == "r"
+    assert line.get_xdata()[-1] == len(y) - 1
+
+    line, = plot_downsampled("u", data=df, ax=ax)
+    assert line.get_label() == "u"
+    assert line.get_xdata()[-1] == len(y) - 1
+
+    line, = plot_downsampled("u", "v", data=df, ax=ax)
+    assert line.get_label() == "v"
+
+    with pytest.raises(TypeError):
+        plot_downsampled(ax=ax)